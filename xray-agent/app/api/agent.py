@@ -1,15 +1,30 @@
 """Agent API endpoints."""
-import uuid
-from typing import Any
-from fastapi import APIRouter, Depends, HTTPException, Security, status
+import asyncio
+import threading
+import time
+from typing import Any, Awaitable, Callable
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, Security, status
 
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.core.reality_config import (
+    get_reality_config_async,
+    get_reality_config_etag,
+    get_reality_short_id,
+)
 from app.core.security import verify_api_key
-from app.schemas.commands import CommandRequest
+from app.schemas.commands import (
+    AddUserCmd,
+    CommandRequest,
+    RegenerateUserCmd,
+    RemoveUserCmd,
+    RestartAgentCmd,
+    RestartXrayCmd,
+)
 from app.services.xray_manager import (
     add_user_to_config,
     get_xray_status,
+    load_xray_config_cached,
     regenerate_user_in_config,
     reload_xray,
     remove_user_from_config,
@@ -33,212 +48,196 @@ async def health_check() -> dict[str, str]:
     return {"status": "healthy", "service": "xray-agent"}
 
 
-@router.post("/commands")
-async def receive_command(
-    request: CommandRequest,
-    api_key: str = Security(verify_api_key),
-) -> dict[str, Any]:
-    """Receive command from Core API.
+def _command_failed(request: AddUserCmd | RemoveUserCmd) -> HTTPException:
+    """Build the generic 400 error for a failed user command."""
+    return HTTPException(
+        status_code=status.HTTP_400_BAD_REQUEST,
+        detail=f"Failed to execute command: {request.command}",
+    )
 
-    Commands: add_user, remove_user, restart_xray
-    """
-    logger.info("Command received", command=request.command, user_uuid=request.user_uuid if hasattr(request, 'user_uuid') else None)
-
-    # Handle commands that don't require UUID
-    if request.command == "restart_xray":
-        success = restart_xray()
-        if success:
-            logger.info("XRay restarted successfully")
-            return {"success": True, "message": "XRay restarted successfully"}
-        else:
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to restart XRay",
-            )
 
-    if request.command == "restart_agent":
-        import threading
-        import time
+async def _handle_restart_xray(request: RestartXrayCmd) -> dict[str, Any]:
+    """Restart XRay service."""
+    success = await asyncio.to_thread(restart_xray)
+    if success:
+        logger.info("XRay restarted successfully")
+        return {"success": True, "message": "XRay restarted successfully"}
+    raise HTTPException(
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        detail="Failed to restart XRay",
+    )
 
-        def _delayed_restart():
-            time.sleep(2)  # Allow HTTP response to be sent first
-            restart_agent()
 
-        threading.Thread(target=_delayed_restart, daemon=True).start()
-        logger.info("Agent restart initiated")
-        return {"success": True, "message": "Agent restart initiated"}
+async def _handle_restart_agent(request: RestartAgentCmd) -> dict[str, Any]:
+    """Restart agent container after the response is sent."""
+    def _delayed_restart():
+        time.sleep(2)  # Allow HTTP response to be sent first
+        restart_agent()
+
+    threading.Thread(target=_delayed_restart, daemon=True).start()
+    logger.info("Agent restart initiated")
+    return {"success": True, "message": "Agent restart initiated"}
 
-    # Handle regenerate_user command (requires both old and new UUID)
-    if request.command == "regenerate_user":
-        if not request.old_user_uuid or not request.user_uuid:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Both old_user_uuid and user_uuid are required for regenerate_user command",
-            )
-        try:
-            uuid.UUID(request.old_user_uuid)
-            uuid.UUID(request.user_uuid)
-        except ValueError:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Invalid UUID format",
-            )
 
-        # Try to regenerate via API first (no reload needed)
-        success, short_id = regenerate_user_via_api(
+async def _handle_regenerate_user(request: RegenerateUserCmd) -> dict[str, Any]:
+    """Replace user UUID."""
+    # Try to regenerate via API first (no reload needed)
+    success, short_id, used_grpc = await regenerate_user_via_api(
+        old_user_uuid=request.old_user_uuid,
+        new_user_uuid=request.user_uuid,
+        email=request.email,
+    )
+    if not success:
+        # Fallback to config update + reload
+        success, short_id = await asyncio.to_thread(
+            regenerate_user_in_config,
             old_user_uuid=request.old_user_uuid,
             new_user_uuid=request.user_uuid,
             email=request.email,
         )
-        if success:
+
+    # Если gRPC был использован - reload НЕ нужен (zero downtime)
+    if success and not used_grpc:
+        if await asyncio.to_thread(reload_xray):
             logger.info(
-                "User regenerated via API (no reload)",
+                "User regenerated and XRay reloaded",
                 old_user_uuid=request.old_user_uuid,
                 new_user_uuid=request.user_uuid,
                 short_id=short_id,
             )
         else:
-            # Fallback to config update + reload
-            success, short_id = regenerate_user_in_config(
-                old_user_uuid=request.old_user_uuid,
-                new_user_uuid=request.user_uuid,
-                email=request.email,
-            )
-            if success:
-                reload_success = reload_xray()
-                if reload_success:
-                    logger.info(
-                        "User regenerated and XRay reloaded",
-                        old_user_uuid=request.old_user_uuid,
-                        new_user_uuid=request.user_uuid,
-                        short_id=short_id,
-                    )
-                else:
-                    logger.warning("User regenerated but XRay reload failed", new_user_uuid=request.user_uuid)
-
-        if not success:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Failed to regenerate user",
-            )
+            logger.warning("User regenerated but XRay reload failed", new_user_uuid=request.user_uuid)
 
-        response = {"success": True, "message": "User regenerated successfully"}
-        if short_id:
-            response["short_id"] = short_id
-        return response
-
-    # Validate UUID format for other user-related commands
-    if not hasattr(request, 'user_uuid') or not request.user_uuid:
+    if not success:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="user_uuid is required for this command",
+            detail="Failed to regenerate user",
         )
 
-    try:
-        uuid.UUID(request.user_uuid)
-    except ValueError:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Invalid UUID format",
-        )
+    response = {"success": True, "message": "User regenerated successfully"}
+    if short_id:
+        response["short_id"] = short_id
+    return response
 
-    # Execute command
-    success = False
-    short_id = None
-    if request.command == "add_user":
-        # Check cache first - if user already exists, skip operation (no reload needed)
-        if user_cache.exists(request.user_uuid, check_sync=True):
-            logger.info("User already exists in cache and XRay, skipping add operation (no reload needed)", user_uuid=request.user_uuid)
-            # Get short_id from Reality config
-            from app.core.reality_config import get_reality_config
-            reality_config = get_reality_config()
-            short_ids = reality_config.get("short_ids", [])
-            short_id = short_ids[0] if short_ids else None
-            success = True
-            used_grpc = False  # User already exists, no operation needed, no reload needed
-            # Don't reload XRay - user already exists
-        else:
-            # Add user via API (will add to config file and via gRPC if available)
-            success, used_grpc = add_user_via_api(request.user_uuid, request.email)
-
-        if success:
-            # Get short_id from Reality config
-            from app.core.reality_config import get_reality_config
-            reality_config = get_reality_config()
-            short_ids = reality_config.get("short_ids", [])
-            short_id = short_ids[0] if short_ids else None
-
-            # Если gRPC был использован - reload НЕ нужен (zero downtime)
-            if used_grpc:
-                logger.info("User added via gRPC API (zero downtime, no reload)", user_uuid=request.user_uuid, short_id=short_id)
-            elif not user_cache.exists(request.user_uuid, check_sync=False):
-                # Fallback на SIGHUP reload только если пользователь был добавлен (не существовал ранее)
-                # Если пользователь уже существовал в кэше, reload не нужен
-                reload_success = reload_xray()
-                if reload_success:
-                    logger.info("User added and XRay reloaded via SIGHUP", user_uuid=request.user_uuid, short_id=short_id)
-                else:
-                    logger.warning("User added but XRay reload failed", user_uuid=request.user_uuid)
-                    success = False
-            else:
-                # User was already in cache, no reload needed
-                logger.info("User already exists, no reload needed", user_uuid=request.user_uuid, short_id=short_id)
-        else:
-            logger.warning("Failed to add user", user_uuid=request.user_uuid)
-            success = False
-    elif request.command == "remove_user":
-        # Check cache first - if user doesn't exist, skip operation
-        if not user_cache.exists(request.user_uuid, check_sync=True):
-            logger.info("User doesn't exist in cache, skipping remove operation", user_uuid=request.user_uuid)
-            success = True  # Already removed, consider it success
-        else:
-            # Try to remove via API (gRPC first, then fallback)
-            success, used_grpc = remove_user_via_api(request.user_uuid)
-            if success:
-                # Если gRPC был использован - reload НЕ нужен (zero downtime)
-                if used_grpc:
-                    logger.info("User removed via gRPC API (zero downtime, no reload)", user_uuid=request.user_uuid)
-                else:
-                    # Fallback на SIGHUP reload (если gRPC не использовался)
-                    reload_success = reload_xray()
-                    if reload_success:
-                        logger.info("User removed and XRay reloaded via SIGHUP", user_uuid=request.user_uuid)
-                    else:
-                        logger.warning("User removed but XRay reload failed", user_uuid=request.user_uuid)
-                        success = False
-            else:
-                # Fallback to config update + reload
-                success = remove_user_from_config(request.user_uuid)
-                if success:
-                    reload_success = reload_xray()
-                    if reload_success:
-                        logger.info("User removed and XRay reloaded", user_uuid=request.user_uuid)
-                    else:
-                        logger.warning("User removed but XRay reload failed", user_uuid=request.user_uuid)
-                        success = False
+
+async def _handle_add_user(request: AddUserCmd) -> dict[str, Any]:
+    """Add user to XRay (gRPC first, SIGHUP reload fallback)."""
+    user_uuid = request.user_uuid
+
+    # Get short_id from Reality config (shared by all users)
+    short_id = await asyncio.to_thread(get_reality_short_id)
+
+    # Check cache first - if user already exists, skip operation (no reload needed)
+    user_was_present = user_cache.exists(user_uuid, check_sync=True)
+    if user_was_present:
+        logger.info("User already exists in cache and XRay, skipping add operation (no reload needed)", user_uuid=user_uuid)
+        success = True
+        used_grpc = False  # User already exists, no operation needed, no reload needed
+        # Don't reload XRay - user already exists
     else:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Unknown command: {request.command}",
-        )
+        # Add user via API (will add to config file and via gRPC if available)
+        success, used_grpc = await add_user_via_api(user_uuid, request.email)
 
     if not success:
-        raise HTTPException(
-            status_code=status.HTTP_400_BAD_REQUEST,
-            detail=f"Failed to execute command: {request.command}",
-        )
+        logger.warning("Failed to add user", user_uuid=user_uuid)
+        raise _command_failed(request)
+
+    if short_id is None:
+        # Add path may have generated a short_id while building a default config
+        short_id = await asyncio.to_thread(get_reality_short_id)
+
+    # Если gRPC был использован - reload НЕ нужен (zero downtime)
+    if used_grpc:
+        logger.info("User added via gRPC API (zero downtime, no reload)", user_uuid=user_uuid, short_id=short_id)
+    elif not user_was_present:
+        # Fallback на SIGHUP reload только если пользователь был добавлен (не существовал ранее)
+        # Если пользователь уже существовал в кэше, reload не нужен
+        if not await asyncio.to_thread(reload_xray):
+            logger.warning("User added but XRay reload failed", user_uuid=user_uuid)
+            raise _command_failed(request)
+        logger.info("User added and XRay reloaded via SIGHUP", user_uuid=user_uuid, short_id=short_id)
+    else:
+        # User was already in cache, no reload needed
+        logger.info("User already exists, no reload needed", user_uuid=user_uuid, short_id=short_id)
 
     response = {"success": True, "message": f"Command {request.command} executed successfully"}
-    if request.command == "add_user" and short_id:
+    if short_id:
         response["short_id"] = short_id
-
     return response
 
 
+async def _handle_remove_user(request: RemoveUserCmd) -> dict[str, Any]:
+    """Remove user from XRay (gRPC first, config update + reload fallback)."""
+    user_uuid = request.user_uuid
+
+    # Check cache first - if user doesn't exist, skip operation
+    if not user_cache.exists(user_uuid, check_sync=True):
+        logger.info("User doesn't exist in cache, skipping remove operation", user_uuid=user_uuid)
+        # Already removed, consider it success
+        return {"success": True, "message": f"Command {request.command} executed successfully"}
+
+    # Try to remove via API (gRPC first, then fallback)
+    success, used_grpc = await remove_user_via_api(user_uuid)
+    if success:
+        # Если gRPC был использован - reload НЕ нужен (zero downtime)
+        if used_grpc:
+            logger.info("User removed via gRPC API (zero downtime, no reload)", user_uuid=user_uuid)
+        elif await asyncio.to_thread(reload_xray):
+            # Fallback на SIGHUP reload (если gRPC не использовался)
+            logger.info("User removed and XRay reloaded via SIGHUP", user_uuid=user_uuid)
+        else:
+            logger.warning("User removed but XRay reload failed", user_uuid=user_uuid)
+            raise _command_failed(request)
+    else:
+        # Fallback to config update + reload
+        if not await asyncio.to_thread(remove_user_from_config, user_uuid):
+            raise _command_failed(request)
+        if not await asyncio.to_thread(reload_xray):
+            logger.warning("User removed but XRay reload failed", user_uuid=user_uuid)
+            raise _command_failed(request)
+        logger.info("User removed and XRay reloaded", user_uuid=user_uuid)
+
+    return {"success": True, "message": f"Command {request.command} executed successfully"}
+
+
+# Command name -> handler
+_HANDLERS: dict[str, Callable[[Any], Awaitable[dict[str, Any]]]] = {
+    "add_user": _handle_add_user,
+    "remove_user": _handle_remove_user,
+    "regenerate_user": _handle_regenerate_user,
+    "restart_xray": _handle_restart_xray,
+    "restart_agent": _handle_restart_agent,
+}
+
+# Config mutations now run in worker threads (load -> modify -> save), so user
+# commands are serialized to keep concurrent commands from losing each other's changes
+_USER_COMMANDS = frozenset({"add_user", "remove_user", "regenerate_user"})
+_user_command_lock = asyncio.Lock()
+
+
+@router.post("/commands")
+async def receive_command(
+    request: CommandRequest,
+    api_key: str = Security(verify_api_key),
+) -> dict[str, Any]:
+    """Receive command from Core API.
+
+    Commands: add_user, remove_user, regenerate_user, restart_xray, restart_agent
+    """
+    logger.info("Command received", command=request.command, user_uuid=getattr(request, "user_uuid", None))
+
+    # Unknown commands are rejected by the discriminated union before we get here
+    handler = _HANDLERS[request.command]
+    if request.command in _USER_COMMANDS:
+        async with _user_command_lock:
+            return await handler(request)
+    return await handler(request)
+
+
 @router.get("/status")
 async def get_status(api_key: str = Security(verify_api_key)) -> dict[str, Any]:
     """Get agent and XRay status."""
-    status_info = get_xray_status()
+    status_info = await asyncio.to_thread(get_xray_status)
     return {
         "agent_version": "0.1.0",
         "server_id": settings.server_id,
@@ -249,11 +248,9 @@ async def get_status(api_key: str = Security(verify_api_key)) -> dict[str, Any]:
 @router.get("/users")
 async def get_xray_users(api_key: str = Security(verify_api_key)) -> dict[str, Any]:
     """Get list of user UUIDs in XRay config (for sync verification)."""
-    from app.services.xray_manager import load_xray_config
-
     uuids = []
     try:
-        config = load_xray_config()
+        config = load_xray_config_cached()
         for inbound in config.get("inbounds", []):
             if inbound.get("protocol") == "vless":
                 clients = inbound.get("settings", {}).get("clients", [])
@@ -268,9 +265,16 @@ async def get_xray_users(api_key: str = Security(verify_api_key)) -> dict[str, A
 
 
 @router.get("/reality")
-async def get_reality_config(api_key: str = Security(verify_api_key)) -> dict[str, Any]:
+async def get_reality_config(
+    request: Request,
+    response: Response,
+    api_key: str = Security(verify_api_key),
+) -> Any:
     """Get Reality configuration parameters.
 
+    Sends a weak ETag based on reality.json mtime; a matching If-None-Match
+    gets 304 Not Modified with no body.
+
     Returns:
         Dictionary with Reality parameters:
         - public_key: Public key for Reality
@@ -279,15 +283,14 @@ async def get_reality_config(api_key: str = Security(verify_api_key)) -> dict[st
         - spx: Service path
         - short_ids: List of short IDs for Reality
     """
-    from app.core.reality_config import (
-        get_reality_public_key,
-        get_reality_fingerprint,
-        get_reality_sni,
-        get_reality_spx,
-        get_reality_config,
-    )
+    reality_config = await get_reality_config_async()
+
+    etag = get_reality_config_etag(reality_config)
+    if etag is not None:
+        if request.headers.get("If-None-Match") == etag:
+            return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+        response.headers["ETag"] = etag
 
-    reality_config = get_reality_config()
     short_ids = reality_config.get("short_ids", [])
 
     # Use first short_id (all users share the same short_id for masquerading)
@@ -297,9 +300,9 @@ async def get_reality_config(api_key: str = Security(verify_api_key)) -> dict[st
         short_ids = []
 
     return {
-        "public_key": get_reality_public_key(),
-        "fingerprint": get_reality_fingerprint(),
-        "sni": get_reality_sni(),
-        "spx": get_reality_spx(),
+        "public_key": reality_config.get("public_key", ""),
+        "fingerprint": reality_config.get("fingerprint", "chrome"),
+        "sni": reality_config.get("sni", "nltimes.nl"),
+        "spx": reality_config.get("spx", "/"),
         "short_ids": short_ids,  # Return all short_ids (usually just one shared short_id)
     }
@@ -18,6 +18,7 @@ class Settings(BaseSettings):
     xray_config_path: str = "/etc/xray/config.json"
     xray_reload_command: str = "docker exec xray-server xray -test -config /etc/xray/config.json && docker exec xray-server kill -SIGHUP 1 || true"
     xray_api_address: str = "127.0.0.1:10085"  # Xray API address for Stats API
+    xray_grpc_timeout_s: float = 10.0  # Дедлайн одного gRPC вызова к XRay API (сек)
 
     # Metrics and monitoring
     metrics_interval: int = 30  # Отправка метрик каждые N секунд
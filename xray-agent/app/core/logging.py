@@ -1,13 +1,59 @@
 """Logging configuration."""
 import logging
+import logging.handlers
+import queue
 import sys
 from pathlib import Path
 
+import orjson
 import structlog
 
 
+def _orjson_dumps(obj, **kwargs) -> str:
+    """Serialize log event with orjson (str output for stdlib logging handlers)."""
+    return orjson.dumps(obj, **kwargs).decode("utf-8")
+
+
+# Log records are enqueued by the caller and written by a listener thread,
+# so stdout/file I/O never runs on the event loop.
+_log_queue: queue.Queue = queue.Queue(maxsize=10000)
+_log_listener: logging.handlers.QueueListener | None = None
+_log_listener_running = False
+
+
+class _NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of erroring when the queue is full."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            pass
+
+
+def start_log_listener() -> None:
+    """Start writing queued log records to the configured handlers."""
+    global _log_listener_running
+    if _log_listener and not _log_listener_running:
+        _log_listener.start()
+        _log_listener_running = True
+
+
+def stop_log_listener() -> None:
+    """Flush queued log records and stop the listener thread."""
+    global _log_listener_running
+    if _log_listener and _log_listener_running:
+        _log_listener.stop()
+        _log_listener_running = False
+
+
 def setup_logging(log_level: str = "INFO") -> None:
-    """Setup structured logging."""
+    """Setup structured logging.
+
+    Records are buffered in a queue until start_log_listener() is called.
+    """
+    global _log_listener
+
     # Setup file logging if logs directory exists
     log_dir = Path("/app/logs")
     handlers = [logging.StreamHandler(sys.stdout)]
@@ -19,24 +65,35 @@ def setup_logging(log_level: str = "INFO") -> None:
         file_handler.setLevel(getattr(logging, log_level.upper()))
         handlers.append(file_handler)
 
+    stop_log_listener()
+    _log_listener = logging.handlers.QueueListener(
+        _log_queue, *handlers, respect_handler_level=True
+    )
+
     logging.basicConfig(
         format="%(message)s",
-        handlers=handlers,
+        handlers=[_NonBlockingQueueHandler(_log_queue)],
         level=getattr(logging, log_level.upper()),
     )
 
+    processors = [
+        structlog.stdlib.filter_by_level,
+        structlog.stdlib.add_logger_name,
+        structlog.stdlib.add_log_level,
+        structlog.stdlib.PositionalArgumentsFormatter(),
+        structlog.processors.TimeStamper(fmt="iso"),
+    ]
+    # stack_info rendering is only useful while debugging
+    if log_level.upper() == "DEBUG":
+        processors.append(structlog.processors.StackInfoRenderer())
+    processors += [
+        structlog.processors.format_exc_info,
+        structlog.processors.UnicodeDecoder(),
+        structlog.processors.JSONRenderer(serializer=_orjson_dumps),
+    ]
+
     structlog.configure(
-        processors=[
-            structlog.stdlib.filter_by_level,
-            structlog.stdlib.add_logger_name,
-            structlog.stdlib.add_log_level,
-            structlog.stdlib.PositionalArgumentsFormatter(),
-            structlog.processors.TimeStamper(fmt="iso"),
-            structlog.processors.StackInfoRenderer(),
-            structlog.processors.format_exc_info,
-            structlog.processors.UnicodeDecoder(),
-            structlog.processors.JSONRenderer(),
-        ],
+        processors=processors,
         context_class=dict,
         logger_factory=structlog.stdlib.LoggerFactory(),
         wrapper_class=structlog.stdlib.BoundLogger,
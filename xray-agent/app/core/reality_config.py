@@ -1,8 +1,14 @@
 """Reality configuration management."""
-import json
+import asyncio
+import os
+import tempfile
+import threading
+import time
 from pathlib import Path
 from typing import Any
 
+import orjson
+
 from app.core.config import settings
 from app.core.logging import get_logger
 from app.utils.reality import (
@@ -18,6 +24,19 @@ logger = get_logger(__name__)
 # Path to Reality config file
 REALITY_CONFIG_PATH = Path("/etc/xray/reality.json")
 
+# Cached Reality config: (st_mtime_ns, config). Invalidated on save or file change.
+_cache: tuple[int, dict[str, Any]] | None = None
+
+# Serializes read-or-create and writes (loads may run in worker threads)
+_lock = threading.RLock()
+
+# Stale-while-revalidate layer for get_reality_config_async: (expires_at, config)
+REALITY_CACHE_TTL = 5.0  # Seconds a snapshot is served without touching the file
+REALITY_CACHE_MAX_STALE = 30.0  # Seconds past TTL a snapshot may be served while refreshing
+_swr_entry: tuple[float, dict[str, Any]] | None = None
+_swr_generation = 0  # Bumped on save so in-flight refreshes drop pre-save results
+_swr_refresh_task: asyncio.Task | None = None
+
 
 def load_reality_config() -> dict[str, Any]:
     """Load Reality configuration from file.
@@ -30,19 +49,124 @@ def load_reality_config() -> dict[str, Any]:
         - fingerprint: Fingerprint (chrome, firefox, etc.)
         - sni: Server Name Indication for masquerading
         - spx: Service path
+
+    The parsed config is cached in memory and reused until the file's mtime
+    changes, so repeated calls cost a single stat() syscall. The returned
+    dict is shared between callers: copy it before modifying.
     """
-    if not REALITY_CONFIG_PATH.exists():
-        logger.info("Reality config not found, creating new one")
-        return create_reality_config()
+    global _cache
+
+    with _lock:
+        try:
+            mtime_ns = REALITY_CONFIG_PATH.stat().st_mtime_ns
+        except FileNotFoundError:
+            logger.info("Reality config not found, creating new one")
+            return create_reality_config()
 
+        if _cache is not None and _cache[0] == mtime_ns:
+            return _cache[1]
+
+        try:
+            with open(REALITY_CONFIG_PATH, "rb") as f:
+                config = orjson.loads(f.read())
+            _cache = (mtime_ns, config)
+            logger.debug("Reality config loaded", path=str(REALITY_CONFIG_PATH))
+            return config
+        except Exception as e:
+            logger.error("Failed to load Reality config, creating new one", error=str(e))
+            return create_reality_config()
+
+
+async def load_reality_config_async() -> dict[str, Any]:
+    """Load Reality configuration without blocking the event loop.
+
+    Cache hits are returned inline (one stat() call); on a miss the file is
+    read and parsed in a worker thread via load_reality_config.
+
+    Returns:
+        Reality configuration dictionary (see load_reality_config)
+    """
     try:
-        with open(REALITY_CONFIG_PATH, "r", encoding="utf-8") as f:
-            config = json.load(f)
-        logger.debug("Reality config loaded", path=str(REALITY_CONFIG_PATH))
-        return config
-    except Exception as e:
-        logger.error("Failed to load Reality config, creating new one", error=str(e))
-        return create_reality_config()
+        mtime_ns = REALITY_CONFIG_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        mtime_ns = None
+
+    cached = _cache
+    if cached is not None and cached[0] == mtime_ns:
+        return cached[1]
+
+    return await asyncio.to_thread(load_reality_config)
+
+
+async def _refresh_reality_snapshot() -> dict[str, Any]:
+    """Reload Reality config and store a fresh snapshot for the SWR layer.
+
+    If the load fails while a stale snapshot exists, the stale snapshot is
+    kept and returned. A result read before a concurrent save is returned
+    to the caller but not stored.
+    """
+    global _swr_entry
+
+    generation = _swr_generation
+    try:
+        config = await load_reality_config_async()
+    except OSError as e:
+        entry = _swr_entry
+        if entry is None:
+            raise
+        logger.error("Failed to refresh Reality config, serving stale snapshot", error=str(e))
+        return entry[1]
+
+    if generation == _swr_generation:
+        _swr_entry = (time.monotonic() + REALITY_CACHE_TTL, config)
+    return config
+
+
+async def get_reality_config_async() -> dict[str, Any]:
+    """Get Reality configuration with TTL + stale-while-revalidate caching.
+
+    Within REALITY_CACHE_TTL the snapshot is returned without any syscall.
+    Up to REALITY_CACHE_MAX_STALE past expiry the stale snapshot is returned
+    and a background refresh is scheduled; beyond that the caller waits for
+    a reload.
+
+    Returns:
+        Reality configuration dictionary
+    """
+    global _swr_refresh_task
+
+    entry = _swr_entry
+    if entry is not None:
+        expires_at, config = entry
+        now = time.monotonic()
+        if now < expires_at:
+            return config
+        if now < expires_at + REALITY_CACHE_MAX_STALE:
+            if _swr_refresh_task is None or _swr_refresh_task.done():
+                _swr_refresh_task = asyncio.create_task(_refresh_reality_snapshot())
+            return config
+
+    return await _refresh_reality_snapshot()
+
+
+def get_reality_config_etag(config: dict[str, Any]) -> str | None:
+    """Get a weak ETag for a config returned by the load functions.
+
+    The tag is derived from the file mtime the config was read at. Returns
+    None if config is not the currently cached file contents (e.g. a stale
+    SWR snapshot or a freshly created config), so it is never tagged with
+    another version's mtime.
+
+    Args:
+        config: Config dict as returned by load/get functions
+
+    Returns:
+        ETag header value or None
+    """
+    cached = _cache
+    if cached is None or cached[1] is not config:
+        return None
+    return f'W/"{cached[0]}"'
 
 
 def save_reality_config(config: dict[str, Any]) -> None:
@@ -51,10 +175,30 @@ def save_reality_config(config: dict[str, Any]) -> None:
     Args:
         config: Reality configuration dictionary
     """
-    REALITY_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(REALITY_CONFIG_PATH, "w", encoding="utf-8") as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    global _cache, _swr_entry, _swr_generation
+
+    data = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+
+    with _lock:
+        REALITY_CONFIG_PATH.parent.mkdir(parents=True, exist_ok=True)
+
+        # Write to a temp file and rename so readers never see a truncated file
+        fd, tmp_path = tempfile.mkstemp(dir=REALITY_CONFIG_PATH.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, REALITY_CONFIG_PATH)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        # Invalidate caches; next load re-reads the file
+        _cache = None
+        _swr_entry = None
+        _swr_generation += 1
 
     logger.info("Reality config saved", path=str(REALITY_CONFIG_PATH))
 
@@ -109,9 +253,10 @@ def add_short_id(short_id: str | None = None) -> str:
     if short_id is None:
         short_id = generate_short_id()
 
-    if short_id not in config.get("short_ids", []):
-        config.setdefault("short_ids", []).append(short_id)
-        save_reality_config(config)
+    short_ids = config.get("short_ids", [])
+    if short_id not in short_ids:
+        # Copy: the loaded dict is the shared cache entry
+        save_reality_config({**config, "short_ids": [*short_ids, short_id]})
         logger.info("Added short ID to Reality config", short_id=short_id)
     else:
         logger.debug("Short ID already exists", short_id=short_id)
@@ -119,6 +264,16 @@ def add_short_id(short_id: str | None = None) -> str:
     return short_id
 
 
+def get_reality_short_id() -> str | None:
+    """Get the Reality short ID handed out to users (first configured one).
+
+    Returns:
+        Short ID, or None if none are configured
+    """
+    short_ids = load_reality_config().get("short_ids", [])
+    return short_ids[0] if short_ids else None
+
+
 def get_reality_public_key() -> str:
     """Get Reality public key.
 
@@ -1,5 +1,5 @@
 """Security middleware and utilities."""
-import secrets
+import hmac
 
 from fastapi import HTTPException, Security, status
 from fastapi.security import APIKeyHeader
@@ -29,8 +29,9 @@ async def verify_api_key(api_key: str = Security(api_key_header)) -> str:
             detail="API key required",
         )
 
-    expected = settings.agent_api_key or ""
-    if not secrets.compare_digest(api_key, expected):
+    # Compare as bytes: compare_digest rejects non-ASCII str with TypeError
+    expected = (settings.agent_api_key or "").encode("utf-8")
+    if not hmac.compare_digest(api_key.encode("utf-8"), expected):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Invalid API key",
@@ -1,15 +1,29 @@
 """Main FastAPI application."""
 import asyncio
+import math
+import os
 from contextlib import asynccontextmanager
+from datetime import datetime
 
-from fastapi import FastAPI, Security
+from fastapi import FastAPI, Request, Response, Security
+from fastapi.exception_handlers import request_validation_exception_handler
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, generate_latest
 
 from app.api.agent import router as agent_router
 from app.core.security import verify_api_key
 from app.core.config import settings
-from app.core.logging import get_logger, setup_logging
-from app.services.core_api_client import CoreAPIClient
+from app.core.logging import get_logger, setup_logging, start_log_listener, stop_log_listener
+from app.schemas.commands import UUID_FIELDS
+from app.services.core_api_client import CoreAPIClient, close_shared_client
 from app.services.user_cache import user_cache
+from app.services.xray_grpc_client import close_grpc_channels
+from app.services.xray_manager import (
+    get_xray_started_at,
+    get_xray_status,
+    invalidate_xray_started_at,
+)
 
 # Setup logging
 setup_logging(log_level=settings.log_level)
@@ -18,6 +32,12 @@ logger = get_logger(__name__)
 # Global client
 core_api_client: CoreAPIClient | None = None
 
+# Prometheus gauges, updated by periodic_tasks and served as-is by /metrics
+METRICS_REGISTRY = CollectorRegistry()
+XRAY_USERS_COUNT = Gauge("xray_agent_users_count", "Number of users in XRay config", registry=METRICS_REGISTRY)
+XRAY_RUNNING = Gauge("xray_agent_xray_running", "1 if XRay API is reachable, 0 otherwise", registry=METRICS_REGISTRY)
+SYSTEM_LOAD = Gauge("xray_agent_system_load", "1-minute system load average", registry=METRICS_REGISTRY)
+
 
 async def register_with_core_api() -> None:
     """Register agent with Core API on startup."""
@@ -51,72 +71,86 @@ async def register_with_core_api() -> None:
         logger.error("Failed to register agent")
 
 
-async def send_metrics_periodically() -> None:
-    """Send metrics to Core API periodically."""
-    from app.services.xray_manager import get_xray_status
+def get_load_avg() -> float:
+    """Get 1-minute system load average."""
+    try:
+        return os.getloadavg()[0]
+    except (OSError, AttributeError):
+        # Fallback if getloadavg not available (Windows or older systems)
+        return 0.0
 
-    while True:
-        try:
-            await asyncio.sleep(settings.metrics_interval)
-
-            if core_api_client:
-                status_info = get_xray_status()
-                # Get system load average (1-minute load average)
-                try:
-                    import os
-                    load_avg = os.getloadavg()[0]  # 1-minute load average
-                except (OSError, AttributeError):
-                    # Fallback if getloadavg not available (Windows or older systems)
-                    load_avg = 0.0
-
-                # Get XRay uptime (approximate, based on process start time)
-                uptime_seconds = 0
-                try:
-                    import subprocess
-                    # Try to get XRay container uptime
-                    result = subprocess.run(
-                        "docker inspect -f '{{.State.StartedAt}}' homevpn_xray_server 2>/dev/null || docker inspect -f '{{.State.StartedAt}}' xray-server 2>/dev/null || echo ''",
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=5,
-                    )
-                    if result.returncode == 0 and result.stdout.strip():
-                        from datetime import datetime
-                        try:
-                            started_at = datetime.fromisoformat(result.stdout.strip().replace('Z', '+00:00'))
-                            uptime_seconds = int((datetime.now(started_at.tzinfo) - started_at).total_seconds())
-                        except Exception:
-                            pass
-                except Exception:
-                    pass
-
-                metrics = {
-                    "load": load_avg,
-                    "users_count": status_info.get("users_count", 0),
-                    "xray_status": "running" if status_info.get("xray_running") else "stopped",
-                    "uptime": uptime_seconds,
-                }
-
-                await core_api_client.send_metrics(metrics)
-                logger.debug("Metrics sent", metrics=metrics)
-
-        except Exception as e:
-            logger.error("Error sending metrics", exc_info=True)
-
-
-async def monitor_xray_status() -> None:
-    """Monitor XRay status and send alerts."""
-    from app.services.xray_manager import get_xray_status
+
+def update_metrics_gauges(status_info: dict, load_avg: float) -> None:
+    """Update Prometheus gauges from a status snapshot.
+
+    Args:
+        status_info: XRay status from get_xray_status()
+        load_avg: 1-minute system load average
+    """
+    XRAY_USERS_COUNT.set(status_info.get("users_count", 0))
+    XRAY_RUNNING.set(1 if status_info.get("xray_running") else 0)
+    SYSTEM_LOAD.set(load_avg)
+
+
+async def report_metrics(status_info: dict, load_avg: float) -> None:
+    """Send metrics to Core API.
+
+    Args:
+        status_info: XRay status from get_xray_status()
+        load_avg: 1-minute system load average
+    """
+    # Get XRay uptime (approximate, based on container start time)
+    uptime_seconds = 0
+    started_at = await asyncio.to_thread(get_xray_started_at)
+    if started_at:
+        uptime_seconds = int((datetime.now(started_at.tzinfo) - started_at).total_seconds())
+
+    metrics = {
+        "load": load_avg,
+        "users_count": status_info.get("users_count", 0),
+        "xray_status": "running" if status_info.get("xray_running") else "stopped",
+        "uptime": uptime_seconds,
+    }
+
+    core_api_client.send_metrics(metrics)
+    logger.debug("Metrics send scheduled", metrics=metrics)
+
+
+async def periodic_tasks() -> None:
+    """Monitor XRay status and send metrics to Core API from a single timer loop.
+
+    Ticks every gcd(metrics_interval, xray_check_interval) seconds; each tick
+    fetches XRay status once, updates the Prometheus gauges, and shares the
+    snapshot between the status check and the metrics report.
+    """
+    tick_seconds = math.gcd(settings.metrics_interval, settings.xray_check_interval) or 1
+    metrics_every = max(1, settings.metrics_interval // tick_seconds)
+    check_every = max(1, settings.xray_check_interval // tick_seconds)
 
     last_status = None
+    tick = 0
 
     while True:
+        await asyncio.sleep(tick_seconds)
+        tick += 1
+
         try:
-            await asyncio.sleep(settings.xray_check_interval)
+            status_info = await asyncio.to_thread(get_xray_status)
+        except Exception:
+            logger.error("Error getting XRay status", exc_info=True)
+            continue
+
+        load_avg = get_load_avg()
+        update_metrics_gauges(status_info, load_avg)
 
-            if core_api_client:
-                status_info = get_xray_status()
+        if not core_api_client:
+            continue
+
+        do_check = tick % check_every == 0
+        do_metrics = tick % metrics_every == 0
+
+        if do_check:
+            try:
                 xray_running = status_info.get("xray_running", False)
 
                 # Check if XRay stopped
@@ -124,16 +158,26 @@ async def monitor_xray_status() -> None:
                     logger.warning("XRay stopped!")
                     await core_api_client.send_event("xray_stopped", data=status_info)
 
+                # XRay came back up - container start time changed
+                if last_status is False and xray_running:
+                    invalidate_xray_started_at()
+
                 last_status = xray_running
+            except Exception as e:
+                logger.error("Error monitoring XRay status", error=str(e))
 
-        except Exception as e:
-            logger.error("Error monitoring XRay status", error=str(e))
+        if do_metrics:
+            try:
+                await report_metrics(status_info, load_avg)
+            except Exception:
+                logger.error("Error sending metrics", exc_info=True)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Lifespan context manager."""
     # Startup
+    start_log_listener()
     logger.info("Starting XRay Agent", version="0.1.0")
 
     # Initialize user cache by syncing from config file
@@ -143,22 +187,31 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         logger.warning("Failed to initialize user cache, will sync on first use", error=str(e))
 
+    # Seed Prometheus gauges so /metrics is populated before the first tick
+    try:
+        update_metrics_gauges(await asyncio.to_thread(get_xray_status), get_load_avg())
+    except Exception as e:
+        logger.warning("Failed to initialize metrics", error=str(e))
+
     # Register with Core API
     await register_with_core_api()
+    logger.info("XRay Agent started", version="0.1.0")
 
     # Start background tasks
-    metrics_task = asyncio.create_task(send_metrics_periodically())
-    monitor_task = asyncio.create_task(monitor_xray_status())
+    periodic_task = asyncio.create_task(periodic_tasks())
 
     yield
 
     # Shutdown
     logger.info("Shutting down XRay Agent")
-    metrics_task.cancel()
-    monitor_task.cancel()
+    periodic_task.cancel()
 
     if core_api_client:
         await core_api_client.close()
+    await close_shared_client()
+    await close_grpc_channels()
+
+    stop_log_listener()
 
 
 # Create FastAPI app
@@ -167,53 +220,44 @@ app = FastAPI(
     description="Agent service for managing XRay on VPN servers",
     version="0.1.0",
     lifespan=lifespan,
+    # Internal API: no interactive docs or OpenAPI schema
+    docs_url=None,
+    redoc_url=None,
+    openapi_url=None,
 )
 
 # Include routers
 app.include_router(agent_router)
 
 
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    """Keep the 400 contracts for unknown commands and missing or malformed command UUIDs."""
+    errors = exc.errors()
+    if len(errors) == 1 and errors[0].get("type") == "union_tag_invalid":
+        command = errors[0].get("ctx", {}).get("tag")
+        return JSONResponse(status_code=400, content={"detail": f"Unknown command: {command}"})
+    if errors and all(
+        error.get("type") in ("missing", "string_pattern_mismatch") and error.get("loc", ("",))[-1] in UUID_FIELDS
+        for error in errors
+    ):
+        # Как и раньше: сначала проверка наличия UUID, потом формата
+        if any(error.get("type") == "missing" for error in errors):
+            if errors[0].get("loc", ("", ""))[1] == "regenerate_user":
+                detail = "Both old_user_uuid and user_uuid are required for regenerate_user command"
+            else:
+                detail = "user_uuid is required for this command"
+            return JSONResponse(status_code=400, content={"detail": detail})
+        return JSONResponse(status_code=400, content={"detail": "Invalid UUID format"})
+    return await request_validation_exception_handler(request, exc)
+
+
 @app.get("/metrics")
 async def metrics(api_key: str = Security(verify_api_key)):
     """Prometheus metrics endpoint.
 
-    Returns basic metrics in Prometheus format.
+    Returns basic metrics in Prometheus format. Values are kept up to date by
+    the periodic task, so scrapes do no work beyond serialization.
     Requires X-API-Key header (same as /status, /reality).
     """
-    from fastapi import Response
-    from app.services.xray_manager import get_xray_status
-
-    try:
-        status_info = get_xray_status()
-        # Get system load average
-        try:
-            import os
-            load_avg = os.getloadavg()[0]
-        except (OSError, AttributeError):
-            load_avg = 0.0
-
-        # Format Prometheus metrics
-        metrics_text = f"""# XRay Agent Metrics
-xray_agent_users_count {status_info.get("users_count", 0)}
-xray_agent_xray_running {1 if status_info.get("xray_running") else 0}
-xray_agent_system_load {load_avg}
-"""
-        return Response(content=metrics_text, media_type="text/plain")
-    except Exception as e:
-        logger.error("Error generating metrics", error=str(e))
-        return Response(
-            content="# XRay Agent Metrics\n# Error generating metrics\n",
-            media_type="text/plain"
-        )
-
-
-@app.on_event("startup")
-async def startup_event() -> None:
-    """Startup event handler."""
-    logger.info("XRay Agent started", version="0.1.0")
-
-
-@app.on_event("shutdown")
-async def shutdown_event() -> None:
-    """Shutdown event handler."""
-    logger.info("XRay Agent shutting down")
+    return Response(content=generate_latest(METRICS_REGISTRY), media_type=CONTENT_TYPE_LATEST)
@@ -1 +1,7 @@
-"""XRay Protocol Buffers generated files."""
+"""XRay Protocol Buffers generated files.
+
+Imports between the generated modules are package-absolute (app.proto...),
+so no sys.path changes are needed. After regenerating with grpc_tools.protoc,
+rewrite its top-level `from common...`, `from core...` and `import command_pb2`
+lines to `from app.proto...` the same way.
+"""
@@ -3,7 +3,7 @@
 import grpc
 import warnings
 
-import command_pb2 as command__pb2
+from app.proto import command_pb2 as command__pb2
 
 GRPC_GENERATED_VERSION = '1.76.0'
 GRPC_VERSION = grpc.__version__
@@ -1,11 +1,55 @@
 """Command schemas."""
+from typing import Annotated, Literal, Union
+
 from pydantic import BaseModel, Field
 
+# Canonical 8-4-4-4-12 hex UUID form; checked by pydantic-core, value stays a str
+UUID_PATTERN = r"^[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}$"
+
+UUIDStr = Annotated[str, Field(pattern=UUID_PATTERN)]
+
+UUID_FIELDS = ("user_uuid", "old_user_uuid")
+
+
+class RestartXrayCmd(BaseModel):
+    """Restart XRay service."""
+
+    command: Literal["restart_xray"]
+
+
+class RestartAgentCmd(BaseModel):
+    """Restart agent container."""
+
+    command: Literal["restart_agent"]
+
 
-class CommandRequest(BaseModel):
-    """Command request schema."""
+class AddUserCmd(BaseModel):
+    """Add user to XRay."""
 
-    command: str = Field(..., description="Command: add_user, remove_user, regenerate_user, or restart_xray")
-    user_uuid: str | None = Field(None, description="UUID пользователя (не требуется для restart_xray)")
-    old_user_uuid: str | None = Field(None, description="Старый UUID пользователя (требуется для regenerate_user)")
+    command: Literal["add_user"]
+    user_uuid: UUIDStr = Field(..., description="UUID пользователя")
     email: str | None = Field(None, description="Email пользователя (опционально)")
+
+
+class RemoveUserCmd(BaseModel):
+    """Remove user from XRay."""
+
+    command: Literal["remove_user"]
+    user_uuid: UUIDStr = Field(..., description="UUID пользователя")
+
+
+class RegenerateUserCmd(BaseModel):
+    """Replace user UUID."""
+
+    command: Literal["regenerate_user"]
+    user_uuid: UUIDStr = Field(..., description="Новый UUID пользователя")
+    old_user_uuid: UUIDStr = Field(..., description="Старый UUID пользователя")
+    email: str | None = Field(None, description="Email пользователя (опционально)")
+
+
+# Pydantic picks the model by "command" and validates only that model's fields;
+# unknown fields (e.g. a stray user_uuid on restart_xray) are ignored
+CommandRequest = Annotated[
+    Union[RestartXrayCmd, RestartAgentCmd, AddUserCmd, RemoveUserCmd, RegenerateUserCmd],
+    Field(discriminator="command"),
+]
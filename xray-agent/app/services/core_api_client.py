@@ -1,16 +1,81 @@
 """Core API client for agent communication."""
-import httpx
+import asyncio
+import time
+import uuid
 from datetime import datetime
 
+import httpx
+import orjson
+
 from app.core.config import settings
 from app.core.logging import get_logger
 from app.utils.retry import retry_with_backoff
 
 logger = get_logger(__name__)
 
+# Identical events (same name and data) sent successfully within this window are dropped
+EVENT_DEDUP_TTL = 2.0
+
+# Circuit breaker: after this many consecutive failed events (Core API down),
+# send_event fails fast for CORE_API_BREAKER_COOLDOWN seconds
+CORE_API_BREAKER_THRESHOLD = 3
+CORE_API_BREAKER_COOLDOWN = 30.0
+
+# Background metrics sends: max in flight, and how long close() waits for them
+METRICS_MAX_IN_FLIGHT = 8
+BACKGROUND_DRAIN_TIMEOUT = 5.0
+
+# Shared by all CoreAPIClient instances; see _get_shared_client
+_shared_client: httpx.AsyncClient | None = None
+
+
+def _is_recoverable(error: Exception) -> bool:
+    """Check if a failed Core API request is worth retrying.
+
+    Connection problems, timeouts and 5xx responses are transient; 4xx
+    (bad API key, validation errors) will fail the same way again.
+    """
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, httpx.TransportError)
+
+
+def _get_shared_client() -> httpx.AsyncClient:
+    """Get process-wide HTTP client for Core API, created on first use."""
+    global _shared_client
+    if _shared_client is None:
+        # Long-lived pooled connections to a single host; HTTP/2 is negotiated
+        # via ALPN on https and lets concurrent events share one connection
+        _shared_client = httpx.AsyncClient(
+            timeout=30.0,
+            transport=httpx.AsyncHTTPTransport(
+                http2=True,
+                retries=0,
+                limits=httpx.Limits(
+                    max_connections=100,
+                    max_keepalive_connections=20,
+                    keepalive_expiry=30.0,
+                ),
+            ),
+        )
+    return _shared_client
+
+
+async def close_shared_client() -> None:
+    """Close process-wide HTTP client (on app shutdown)."""
+    global _shared_client
+    if _shared_client is not None:
+        client, _shared_client = _shared_client, None
+        await client.aclose()
+
 
 class CoreAPIClient:
-    """Client for communicating with Core API."""
+    """Client for communicating with Core API.
+
+    Create one long-lived instance per process (app.main keeps it in a
+    module global for the app lifetime) rather than one per request. It can
+    also be used as an async context manager, which calls close() on exit.
+    """
 
     def __init__(self, base_url: str, api_key: str):
         """Initialize Core API client.
@@ -21,10 +86,28 @@ class CoreAPIClient:
         """
         self.base_url = base_url.rstrip("/")
         self.api_key = api_key
-        self.client = httpx.AsyncClient(
-            timeout=30.0,
-            headers={"X-API-Key": api_key},
-        )
+        # Bodies are pre-serialized with orjson, so Content-Type is set here
+        self._headers = {"X-API-Key": api_key, "Content-Type": "application/json"}
+        # Pre-encoded '{"server_id":...' prefix of every webhook body
+        self._event_prefix = orjson.dumps({"server_id": settings.server_id})[:-1]
+        # (event, sorted data JSON) -> monotonic expiry of the last successful send
+        self._recent: dict[tuple[str, bytes], float] = {}
+        self._consecutive_failures = 0
+        self._open_until = 0.0  # monotonic time until which the breaker is open
+        # Fire-and-forget metrics tasks (kept referenced until done)
+        self._bg: set[asyncio.Task] = set()
+        self._bg_sem = asyncio.Semaphore(METRICS_MAX_IN_FLIGHT)
+
+    async def __aenter__(self) -> "CoreAPIClient":
+        return self
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.close()
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        """Shared HTTP client (one connection pool for all instances)."""
+        return _get_shared_client()
 
     async def register_agent(self, agent_url: str, version: str) -> bool:
         """Register agent in Core API.
@@ -39,10 +122,11 @@ class CoreAPIClient:
         try:
             response = await self.client.post(
                 f"{self.base_url}/api/v1/servers/{settings.server_id}/agent/register",
-                json={
+                content=orjson.dumps({
                     "agent_url": agent_url,
                     "version": version,
-                },
+                }),
+                headers=self._headers,
             )
 
             if response.status_code == 201:
@@ -73,15 +157,35 @@ class CoreAPIClient:
 
         Returns:
             True if sent successfully, False otherwise
+
+        Every attempt carries the same X-Request-Id, so Core API can drop
+        duplicates by (server_id, X-Request-Id) when a retry follows a
+        request that was processed but whose response was lost.
+
+        An event identical to one sent successfully less than
+        EVENT_DEDUP_TTL seconds ago is skipped and reported as sent. While
+        the circuit breaker is open (Core API unreachable), returns False
+        without sending.
         """
+        # Data is serialized once: it is both the dedup key and the body's "data"
+        data_json = orjson.dumps(data or {}, option=orjson.OPT_SORT_KEYS)
+        dedup_key = (event, data_json)
+        now = time.monotonic()
+        if self._recent.get(dedup_key, 0.0) > now:
+            logger.debug("Duplicate event skipped", event_type=event)
+            return True
+        if self._open_until > now:
+            logger.debug("Core API circuit open, event not sent", event_type=event)
+            return False
+
+        headers = {**self._headers, "X-Request-Id": uuid.uuid4().hex}
+        content = self._event_prefix + b',"event":' + orjson.dumps(event) + b',"data":' + data_json + b"}"
+
         async def _send():
             response = await self.client.post(
                 f"{self.base_url}/api/v1/agents/webhook",
-                json={
-                    "event": event,
-                    "server_id": settings.server_id,
-                    "data": data or {},
-                },
+                content=content,
+                headers=headers,
             )
 
             if response.status_code == 200:
@@ -99,8 +203,23 @@ class CoreAPIClient:
 
         try:
             # Use retry with exponential backoff for resilience
-            result = await retry_with_backoff(_send, max_retries=2, initial_delay=1.0)
-            return result if result is not None else False
+            result = await retry_with_backoff(
+                _send,
+                max_retries=2,
+                initial_delay=1.0,
+                max_delay=30.0,
+                jitter=0.5,
+                should_retry=_is_recoverable,
+            )
+            if not result:
+                return False
+
+            self._consecutive_failures = 0
+            # Remember successful send; drop expired keys so the dict stays small
+            now = time.monotonic()
+            self._recent = {k: t for k, t in self._recent.items() if t > now}
+            self._recent[dedup_key] = now + EVENT_DEDUP_TTL
+            return True
         except (httpx.HTTPError, httpx.ConnectError, httpx.TimeoutException) as e:
             # For connection errors, log warning instead of error (less noisy)
             logger.warning(
@@ -108,22 +227,59 @@ class CoreAPIClient:
                 event_type=event,
                 error=str(e)
             )
+            if _is_recoverable(e):
+                self._record_failure()
             return False
         except Exception as e:
             logger.error("Error sending event", exc_info=True, event_type=event)
             return False
 
-    async def send_metrics(self, metrics: dict) -> bool:
-        """Send metrics to Core API.
+    def _record_failure(self) -> None:
+        """Count a failed event; open the circuit breaker at the threshold.
+
+        The count is kept until a success, so after the cooldown a single
+        failed probe reopens the breaker.
+        """
+        self._consecutive_failures += 1
+        if self._consecutive_failures >= CORE_API_BREAKER_THRESHOLD:
+            self._open_until = time.monotonic() + CORE_API_BREAKER_COOLDOWN
+            logger.warning(
+                "Core API unreachable, pausing events",
+                cooldown_seconds=CORE_API_BREAKER_COOLDOWN,
+            )
+
+    def send_metrics(self, metrics: dict) -> None:
+        """Send metrics to Core API in the background.
+
+        Returns immediately; the send (with retries) runs as a task, at most
+        METRICS_MAX_IN_FLIGHT at a time, so a slow Core API doesn't hold up
+        the caller's loop.
 
         Args:
             metrics: Metrics dictionary
-
-        Returns:
-            True if sent successfully, False otherwise
         """
-        return await self.send_event("metrics", data=metrics)
+        task = asyncio.create_task(self._guarded_send_metrics(metrics))
+        self._bg.add(task)
+        task.add_done_callback(self._bg.discard)
+
+    async def _guarded_send_metrics(self, metrics: dict) -> None:
+        """Send metrics event, limited by the background semaphore."""
+        async with self._bg_sem:
+            await self.send_event("metrics", data=metrics)
 
     async def close(self):
-        """Close HTTP client."""
-        await self.client.aclose()
+        """Release this client.
+
+        Waits up to BACKGROUND_DRAIN_TIMEOUT for background metrics sends,
+        then cancels the rest. The connection pool is shared by all
+        instances and stays open; it is closed by close_shared_client()
+        on shutdown.
+        """
+        if not self._bg:
+            return
+        _, pending = await asyncio.wait(set(self._bg), timeout=BACKGROUND_DRAIN_TIMEOUT)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.warning("Cancelled pending metrics sends on close", count=len(pending))
+            await asyncio.gather(*pending, return_exceptions=True)
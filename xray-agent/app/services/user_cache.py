@@ -1,9 +1,12 @@
 """In-memory cache for XRay users to avoid frequent config file reads."""
-from datetime import datetime, timedelta
+import time
+from datetime import datetime
+from pathlib import Path
 from typing import Set
 
+from app.core.config import settings
 from app.core.logging import get_logger
-from app.services.xray_manager import load_xray_config
+from app.services.xray_manager import load_xray_config_cached
 
 logger = get_logger(__name__)
 
@@ -18,9 +21,10 @@ class UserCache:
             sync_interval_minutes: How often to sync with config file (default: 5 minutes)
         """
         self._users: Set[str] = set()  # UUID пользователей
-        self._last_sync: datetime | None = None
-        self._sync_interval = timedelta(minutes=sync_interval_minutes)
-        self._last_xray_reload: datetime | None = None  # Время последней перезагрузки XRay
+        self._last_sync: float | None = None  # time.monotonic() последней синхронизации
+        self._last_stat_key: tuple[int, int] | None = None  # (mtime_ns, size) конфига при последней синхронизации
+        self._sync_interval = sync_interval_minutes * 60.0  # секунды
+        self._last_xray_reload: float | None = None  # time.monotonic() последней перезагрузки XRay
 
     def exists(self, user_uuid: str, check_sync: bool = True) -> bool:
         """Проверить существование пользователя в кэше.
@@ -56,21 +60,37 @@ class UserCache:
         logger.debug("User removed from cache", user_uuid=user_uuid)
 
     def sync_from_config(self):
-        """Синхронизировать кэш с конфиг файлом."""
+        """Синхронизировать кэш с конфиг файлом.
+
+        Если конфиг не менялся с прошлой синхронизации (те же mtime и размер),
+        множество не пересобирается — обновляется только время синхронизации.
+        """
         try:
-            config = load_xray_config()
-            users = set()
-            for inbound in config.get("inbounds", []):
-                if inbound.get("protocol") == "vless":
-                    clients = inbound.get("settings", {}).get("clients", [])
-                    for client in clients:
-                        user_uuid = client.get("id")
-                        if user_uuid:
-                            users.add(user_uuid)
+            try:
+                # Размер тоже: при грубых timestamp две записи подряд дают один mtime
+                stat = Path(settings.xray_config_path).stat()
+                stat_key = (stat.st_mtime_ns, stat.st_size)
+            except FileNotFoundError:
+                stat_key = None
+
+            if stat_key is not None and stat_key == self._last_stat_key:
+                self._last_sync = time.monotonic()
+                logger.debug("Config unchanged, cache sync skipped", users_count=len(self._users))
+                return
+
+            config = load_xray_config_cached()
+            users = {
+                client["id"]
+                for inbound in config.get("inbounds", ())
+                if inbound.get("protocol") == "vless"
+                for client in inbound.get("settings", {}).get("clients", ())
+                if client.get("id")
+            }
 
             old_count = len(self._users)
             self._users = users
-            self._last_sync = datetime.now()
+            self._last_sync = time.monotonic()
+            self._last_stat_key = stat_key
             logger.info(
                 "Cache synced from config",
                 users_count=len(users),
@@ -84,7 +104,7 @@ class UserCache:
         if self._last_sync is None:
             # Первая синхронизация
             self.sync_from_config()
-        elif datetime.now() - self._last_sync >= self._sync_interval:
+        elif time.monotonic() - self._last_sync >= self._sync_interval:
             # Время синхронизировать
             self.sync_from_config()
 
@@ -92,12 +112,13 @@ class UserCache:
         """Очистить кэш."""
         self._users.clear()
         self._last_sync = None
+        self._last_stat_key = None
         logger.debug("Cache cleared")
 
     def mark_xray_reloaded(self):
         """Отметить что XRay был перезагружен."""
-        self._last_xray_reload = datetime.now()
-        logger.debug("XRay reload marked", timestamp=self._last_xray_reload.isoformat())
+        self._last_xray_reload = time.monotonic()
+        logger.debug("XRay reload marked", timestamp=datetime.now().isoformat())
 
     def should_reload_xray(self, user_uuid: str) -> bool:
         """Проверить нужно ли перезагрузить XRay для пользователя.
@@ -108,34 +129,24 @@ class UserCache:
         Returns:
             True если нужно перезагрузить XRay, False иначе
         """
+        now = time.monotonic()
+
         # Если XRay был перезагружен недавно (менее 5 минут назад), не перезагружаем
-        if self._last_xray_reload:
-            time_since_reload = datetime.now() - self._last_xray_reload
-            if time_since_reload < timedelta(minutes=5):
+        if self._last_xray_reload is not None:
+            time_since_reload = now - self._last_xray_reload
+            if time_since_reload < 5 * 60:
                 return False
 
         # Если пользователь в кэше (и кэш недавно синхронизирован), не перезагружаем
-        if self._last_sync and datetime.now() - self._last_sync < timedelta(minutes=1):
+        if self._last_sync is not None and now - self._last_sync < 60:
             if user_uuid in self._users:
                 return False
 
-        # Проверить в конфиге без синхронизации кэша
-        try:
-            config = load_xray_config()
-            for inbound in config.get("inbounds", []):
-                if inbound.get("protocol") == "vless":
-                    clients = inbound.get("settings", {}).get("clients", [])
-                    for client in clients:
-                        if client.get("id") == user_uuid:
-                            # Пользователь в конфиге, но возможно не в памяти XRay
-                            # Если XRay был перезапущен недавно или кэш пустой → перезагрузить
-                            if not self._last_xray_reload or datetime.now() - self._last_xray_reload > timedelta(minutes=5):
-                                return True
-                            return False
-        except Exception:
-            pass
-
-        return False
+        # Пользователь в конфиге, но возможно не в памяти XRay.
+        # Сюда доходим только если XRay не перезагружался последние 5 минут → перезагрузить.
+        # sync_from_config стоит один stat(), если конфиг не менялся
+        self.sync_from_config()
+        return user_uuid in self._users
 
     def get_all(self) -> Set[str]:
         """Получить все UUID пользователей из кэша.
@@ -1,15 +1,42 @@
 """XRay API client for dynamic user management."""
-import json
-import subprocess
+import asyncio
 from typing import Any
 
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.core.reality_config import get_reality_short_id
 from app.services.user_cache import user_cache
+from app.services.xray_grpc_client import grpc_client
+from app.services.xray_manager import (
+    get_default_config,
+    load_xray_config,
+    reload_xray,
+    save_xray_config,
+    validate_xray_config,
+)
 
 logger = get_logger(__name__)
 
 
+def _index_clients(clients: list[dict[str, Any]]) -> tuple[dict[str, int], dict[str, int]]:
+    """Build UUID -> position and email -> position indexes for inbound clients.
+
+    Args:
+        clients: Inbound clients list
+
+    Returns:
+        Tuple of (by_uuid, by_email)
+    """
+    by_uuid: dict[str, int] = {}
+    by_email: dict[str, int] = {}
+    for i, client in enumerate(clients):
+        if client.get("id"):
+            by_uuid[client["id"]] = i
+        if client.get("email"):
+            by_email[client["email"]] = i
+    return by_uuid, by_email
+
+
 def update_inbound_via_api(inbound_config: dict[str, Any], tag: str = "vless") -> bool:
     """Update inbound configuration via HandlerService API (dynamic, no reload needed).
 
@@ -32,7 +59,7 @@ def update_inbound_via_api(inbound_config: dict[str, Any], tag: str = "vless") -
         return False
 
 
-def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bool]:
+async def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bool]:
     """Add user to Xray via HandlerService API (dynamic, no reload needed).
 
     Args:
@@ -44,10 +71,8 @@ def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bo
         - success: True if user was added successfully
         - used_grpc: True if gRPC was used (zero downtime), False if fallback to SIGHUP
     """
-    from app.services.xray_manager import load_xray_config, save_xray_config
-
     # Load current config
-    config = load_xray_config()
+    config = await asyncio.to_thread(load_xray_config)
 
     # Find VLESS inbound
     vless_inbound = None
@@ -61,46 +86,38 @@ def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bo
     if not vless_inbound:
         # Config has wrong protocol (e.g. VMess instead of VLESS Reality) — replace with default
         logger.warning("VLESS inbound not found, replacing config with VLESS Reality default")
-        from app.services.xray_manager import get_default_config, save_xray_config, validate_xray_config
-        from app.services.xray_manager import reload_xray
 
-        default_config = get_default_config()
-        valid, err = validate_xray_config(default_config)
+        default_config = await asyncio.to_thread(get_default_config, config)  # users from the config we already parsed
+        valid, err = await asyncio.to_thread(validate_xray_config, default_config)
         if not valid:
             logger.error("Default config validation failed", error=err)
             return False, False
 
-        save_xray_config(default_config)
-        if not reload_xray():
+        await asyncio.to_thread(save_xray_config, default_config)
+        if not await asyncio.to_thread(reload_xray):
             logger.error("Failed to reload XRay with new config")
             return False, False
 
         logger.info("XRay config replaced with VLESS Reality, retrying add_user")
-        return add_user_via_api(user_uuid, email)  # Retry once with new config
+        return await add_user_via_api(user_uuid, email)  # Retry once with new config
 
     # Check if user already exists (by UUID)
     clients = vless_inbound.get("settings", {}).get("clients", [])
-    for client in clients:
-        if client.get("id") == user_uuid:
-            logger.info("User already exists in XRay - this is OK", user_uuid=user_uuid)
-            # User already exists - this is OK, return True (no gRPC needed, no reload needed)
-            return True, False  # success=True, used_grpc=False
+    by_uuid, by_email = _index_clients(clients)
+    if user_uuid in by_uuid:
+        logger.info("User already exists in XRay - this is OK", user_uuid=user_uuid)
+        # User already exists - this is OK, return True (no gRPC needed, no reload needed)
+        return True, False  # success=True, used_grpc=False
 
     # 3. Добавление нового пользователя
     email_to_use = email or f"user-{user_uuid[:8]}"
-    # Remove any duplicate emails before adding
-    clients = [c for c in clients if not (c.get("email") == email_to_use and c.get("id") != user_uuid)]
-
-    # Remove any duplicate emails before adding (XRay doesn't allow duplicate emails)
-    email_to_use = email or f"user-{user_uuid[:8]}"
-    # Remove clients with same email but different UUID (keep only the one with matching UUID)
-    clients = [c for c in clients if not (c.get("email") == email_to_use and c.get("id") != user_uuid)]
+    # Remove client with same email (XRay doesn't allow duplicate emails);
+    # its UUID differs, otherwise we'd have returned above
+    if email_to_use in by_email:
+        del clients[by_email[email_to_use]]
 
     # Add new user
-    from app.core.reality_config import get_reality_config
-    reality_config = get_reality_config()
-    short_ids = reality_config.get("short_ids", [])
-    short_id = short_ids[0] if short_ids else None
+    short_id = await asyncio.to_thread(get_reality_short_id)
 
     new_client = {
         "id": user_uuid,
@@ -111,12 +128,10 @@ def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bo
     vless_inbound["settings"]["clients"] = clients
 
     # Попытка добавить через gRPC API (zero downtime)
-    from app.services.xray_grpc_client import grpc_client
-
-    if grpc_client.is_available():
-        if grpc_client.add_user(tag=inbound_tag, user_uuid=user_uuid, email=email_to_use):
+    if await asyncio.to_thread(grpc_client.is_available):
+        if await grpc_client.add_user(tag=inbound_tag, user_uuid=user_uuid, email=email_to_use):
             # Сохраняем в конфиг для persistence (после перезапуска XRay)
-            save_xray_config(config)
+            await asyncio.to_thread(save_xray_config, config)
             # Обновляем кэш
             user_cache.add(user_uuid)
             logger.info("User added via gRPC API (zero downtime, no reload)", user_uuid=user_uuid, short_id=short_id)
@@ -125,14 +140,14 @@ def add_user_via_api(user_uuid: str, email: str | None = None) -> tuple[bool, bo
             logger.warning("gRPC add_user failed, falling back to SIGHUP reload", user_uuid=user_uuid)
 
     # Fallback to config file update + SIGHUP reload (если gRPC недоступен или не сработал)
-    save_xray_config(config)
+    await asyncio.to_thread(save_xray_config, config)
     # Update cache
     user_cache.add(user_uuid)
     logger.info("User added via config update (SIGHUP reload fallback)", user_uuid=user_uuid)
     return True, False  # success=True, used_grpc=False
 
 
-def remove_user_via_api(user_uuid: str) -> tuple[bool, bool]:
+async def remove_user_via_api(user_uuid: str) -> tuple[bool, bool]:
     """Remove user from Xray via HandlerService API (dynamic, no reload needed).
 
     Args:
@@ -143,10 +158,8 @@ def remove_user_via_api(user_uuid: str) -> tuple[bool, bool]:
         - success: True if user was removed successfully
         - used_grpc: True if gRPC was used (zero downtime), False if fallback to SIGHUP
     """
-    from app.services.xray_manager import load_xray_config, save_xray_config
-
     # Load current config
-    config = load_xray_config()
+    config = await asyncio.to_thread(load_xray_config)
 
     # Find VLESS inbound
     vless_inbound = None
@@ -163,28 +176,22 @@ def remove_user_via_api(user_uuid: str) -> tuple[bool, bool]:
 
     # Найти email пользователя перед удалением (нужен для gRPC)
     clients = vless_inbound.get("settings", {}).get("clients", [])
-    user_email = None
-    user_found = False
-
-    for client in clients:
-        if client.get("id") == user_uuid:
-            user_email = client.get("email")
-            user_found = True
-            break
+    by_uuid, _ = _index_clients(clients)
+    user_index = by_uuid.get(user_uuid)
 
-    if not user_found:
+    if user_index is None:
         logger.warning("User not found in config", user_uuid=user_uuid)
         return False, False
 
-    # Попытка удалить через gRPC API (zero downtime)
-    from app.services.xray_grpc_client import grpc_client
+    user_email = clients[user_index].get("email")
 
-    if grpc_client.is_available() and user_email:
-        if grpc_client.remove_user(tag=inbound_tag, user_uuid=user_uuid, email=user_email):
+    # Попытка удалить через gRPC API (zero downtime)
+    if user_email and await asyncio.to_thread(grpc_client.is_available):
+        if await grpc_client.remove_user(tag=inbound_tag, user_uuid=user_uuid, email=user_email):
             # Удаляем из конфига для синхронизации
-            clients[:] = [c for c in clients if c.get("id") != user_uuid]
+            del clients[user_index]
             vless_inbound["settings"]["clients"] = clients
-            save_xray_config(config)
+            await asyncio.to_thread(save_xray_config, config)
             # Обновляем кэш
             user_cache.remove(user_uuid)
             logger.info("User removed via gRPC API (zero downtime, no reload)", user_uuid=user_uuid)
@@ -192,16 +199,20 @@ def remove_user_via_api(user_uuid: str) -> tuple[bool, bool]:
 
     # Fallback to config file update + SIGHUP reload (если gRPC недоступен или не сработал)
     logger.warning("gRPC remove_user failed or unavailable, falling back to SIGHUP reload", user_uuid=user_uuid)
-    clients[:] = [c for c in clients if c.get("id") != user_uuid]
+    del clients[user_index]
     vless_inbound["settings"]["clients"] = clients
-    save_xray_config(config)
+    await asyncio.to_thread(save_xray_config, config)
     # Update cache
     user_cache.remove(user_uuid)
     logger.info("User removed via config update (SIGHUP reload fallback)", user_uuid=user_uuid)
     return True, False  # success=True, used_grpc=False
 
 
-def regenerate_user_via_api(old_user_uuid: str, new_user_uuid: str, email: str | None = None) -> tuple[bool, str | None]:
+async def regenerate_user_via_api(
+    old_user_uuid: str,
+    new_user_uuid: str,
+    email: str | None = None,
+) -> tuple[bool, str | None, bool]:
     """Regenerate user via HandlerService API (dynamic, no reload needed).
 
     Args:
@@ -210,13 +221,12 @@ def regenerate_user_via_api(old_user_uuid: str, new_user_uuid: str, email: str |
         email: Email for new user (optional)
 
     Returns:
-        Tuple of (success: bool, short_id: str | None)
+        Tuple of (success: bool, short_id: str | None, used_grpc: bool)
+        - used_grpc: True if XRay was updated via gRPC (or nothing changed),
+          False if a SIGHUP reload is needed
     """
-    from app.services.xray_manager import load_xray_config, save_xray_config
-    from app.core.reality_config import get_reality_config
-
     # Load current config
-    config = load_xray_config()
+    config = await asyncio.to_thread(load_xray_config)
 
     # Find VLESS inbound
     vless_inbound = None
@@ -229,51 +239,78 @@ def regenerate_user_via_api(old_user_uuid: str, new_user_uuid: str, email: str |
 
     if not vless_inbound:
         logger.error("VLESS inbound not found")
-        return False, None
+        return False, None, False
 
     clients = vless_inbound.get("settings", {}).get("clients", [])
 
-    # Remove old user
-    original_count = len(clients)
-    clients[:] = [c for c in clients if c.get("id") != old_user_uuid]
-    removed = len(clients) < original_count
+    # Remove old user (email нужен для gRPC remove)
+    by_uuid, _ = _index_clients(clients)
+    old_index = by_uuid.get(old_user_uuid)
+
+    # Replace with an identical client (same UUID and email): nothing to save, push or reload
+    if (
+        old_user_uuid == new_user_uuid
+        and old_index is not None
+        and clients[old_index].get("email") == (email or f"user-{new_user_uuid[:8]}")
+        and clients[old_index].get("flow") == "xtls-rprx-vision"
+    ):
+        logger.info("User regenerated with unchanged UUID and email, nothing to do", user_uuid=new_user_uuid)
+        return True, await asyncio.to_thread(get_reality_short_id), True
+    old_email = None
+    if old_index is not None:
+        old_email = clients[old_index].get("email")
+        del clients[old_index]
 
     # Add new user
-    reality_config = get_reality_config()
-    short_ids = reality_config.get("short_ids", [])
-    short_id = short_ids[0] if short_ids else None
-
-    new_client = {
-        "id": new_user_uuid,
-        "email": email or f"user-{new_user_uuid[:8]}",
-        "flow": "xtls-rprx-vision",  # Used with Reality (as competitor config shows)
-    }
-    clients.append(new_client)
+    short_id = await asyncio.to_thread(get_reality_short_id)
+
+    email_to_use = email or f"user-{new_user_uuid[:8]}"
+    # Повторный regenerate: новый UUID уже в конфиге — не добавляем дубликат
+    by_uuid, by_email = _index_clients(clients)
+    new_exists = new_user_uuid in by_uuid
+    if new_exists:
+        logger.info("New user UUID already exists in XRay config - this is OK", user_uuid=new_user_uuid)
+        if old_index is None:
+            # Old already removed and new already added: nothing to save, push or reload
+            return True, short_id, True
+    else:
+        # Remove client with same email (XRay doesn't allow duplicate emails)
+        if email_to_use in by_email:
+            del clients[by_email[email_to_use]]
+        new_client = {
+            "id": new_user_uuid,
+            "email": email_to_use,
+            "flow": "xtls-rprx-vision",  # Used with Reality (as competitor config shows)
+        }
+        clients.append(new_client)
     vless_inbound["settings"]["clients"] = clients
 
-    # Try to update via API first (no reload needed!)
-    if update_inbound_via_api(vless_inbound, tag=inbound_tag):
-        # Also save to config file for persistence
-        save_xray_config(config)
-        # Update cache
-        user_cache.remove(old_user_uuid)
-        user_cache.add(new_user_uuid)
-        logger.info(
-            "User regenerated via API (no reload)",
-            old_user_uuid=old_user_uuid,
-            new_user_uuid=new_user_uuid,
-            short_id=short_id,
-        )
-        return True, short_id
-    else:
-        # Fallback to config file update + SIGHUP reload
-        save_xray_config(config)
-        # Update cache
-        user_cache.remove(old_user_uuid)
-        user_cache.add(new_user_uuid)
-        logger.info(
-            "User regenerated via config update (SIGHUP reload)",
-            old_user_uuid=old_user_uuid,
-            new_user_uuid=new_user_uuid,
+    # Save first: config is the source of truth, also for the SIGHUP fallback
+    await asyncio.to_thread(save_xray_config, config)
+    # Update cache
+    user_cache.remove(old_user_uuid)
+    user_cache.add(new_user_uuid)
+
+    # Попытка заменить через gRPC API (zero downtime): remove старого, затем add нового
+    if await asyncio.to_thread(grpc_client.is_available):
+        removed = old_email is None or await grpc_client.remove_user(
+            tag=inbound_tag, user_uuid=old_user_uuid, email=old_email,
         )
-        return True, short_id
+        if removed and (
+            new_exists or await grpc_client.add_user(tag=inbound_tag, user_uuid=new_user_uuid, email=email_to_use)
+        ):
+            logger.info(
+                "User regenerated via gRPC API (zero downtime, no reload)",
+                old_user_uuid=old_user_uuid,
+                new_user_uuid=new_user_uuid,
+                short_id=short_id,
+            )
+            return True, short_id, True
+        logger.warning("gRPC regenerate failed, falling back to SIGHUP reload", new_user_uuid=new_user_uuid)
+
+    logger.info(
+        "User regenerated via config update (SIGHUP reload fallback)",
+        old_user_uuid=old_user_uuid,
+        new_user_uuid=new_user_uuid,
+    )
+    return True, short_id, False
@@ -1,28 +1,60 @@
 """gRPC client for XRay HandlerService API."""
-import json
-import subprocess
+import asyncio
+import functools
+import socket
+import time
 from typing import Any
 
 import grpc
+import grpc.aio
 
 from app.core.config import settings
 from app.core.logging import get_logger
 
 logger = get_logger(__name__)
 
+# Channel options: gRPC-level retries plus keepalive so an idle channel notices a dead XRay
+GRPC_CHANNEL_OPTIONS = [
+    ("grpc.enable_retries", 1),
+    ("grpc.keepalive_time_ms", 30000),
+]
+ALTER_INBOUND_METHOD = "/xray.app.proxyman.command.HandlerService/AlterInbound"
+AVAILABILITY_CACHE_TTL = 1.0  # seconds an is_available() result is reused
+GRPC_MAX_ATTEMPTS = 2  # AlterInbound attempts when XRay is UNAVAILABLE (e.g. just restarted)
+
+# Pre-resolved "host:port" -> "ip:port" (Docker DNS is slow); refreshed when XRay is unreachable
+_resolved_addresses: dict[str, str] = {}
+
+# UUID -> email index for _find_email_by_uuid: (config it was built from, index)
+_uuid_index: tuple[dict[str, Any], dict[str, str]] | None = None
+
+# Process-wide channels shared by all XRayGRPCClient instances: address -> (channel, stub).
+# Async (grpc.aio) channels bind to the running event loop, so they are created on first use
+_channels: dict[str, tuple[grpc.aio.Channel, Any]] = {}
+
 # Импортируем сгенерированные proto файлы
 try:
-    import sys
-    from pathlib import Path
-    proto_path = Path(__file__).parent.parent / "proto"
-    if str(proto_path) not in sys.path:
-        sys.path.insert(0, str(proto_path))
-
-    import command_pb2
-    import command_pb2_grpc
-    from common.protocol import user_pb2
-    from common.serial import typed_message_pb2
-    from proxy.vless import account_pb2
+    import os
+
+    # Нативный upb-бэкенд protobuf (должен быть выбран до первого импорта _pb2);
+    # переменную окружения можно переопределить снаружи
+    os.environ.setdefault("PROTOCOL_BUFFERS_PYTHON_IMPLEMENTATION", "upb")
+
+    from google.protobuf.internal import api_implementation
+
+    from app.proto import command_pb2
+    from app.proto.common.protocol import user_pb2
+    from app.proto.common.serial import typed_message_pb2
+    from app.proto.proxy.vless import account_pb2
+
+    if api_implementation.Type() == "python":
+        logger.warning("Pure-Python protobuf backend in use, gRPC calls will be slower")
+
+    # TypedMessage.type values: full type name WITHOUT type.googleapis.com/ prefix,
+    # as XRay expects (e.g. xray.app.proxyman.command.AddUserOperation)
+    _VLESS_ACCOUNT_TYPE = account_pb2.Account.DESCRIPTOR.full_name
+    _ADD_OP_TYPE = command_pb2.AddUserOperation.DESCRIPTOR.full_name
+    _REMOVE_OP_TYPE = command_pb2.RemoveUserOperation.DESCRIPTOR.full_name
 
     PROTO_AVAILABLE = True
 except ImportError as e:
@@ -30,13 +62,87 @@ except ImportError as e:
     PROTO_AVAILABLE = False
 
 
+@functools.lru_cache(maxsize=1024)
+def _serialize_add_user(tag: str, user_uuid: str, email: str, flow: str) -> bytes:
+    """Build serialized AlterInboundRequest with AddUserOperation.
+
+    Memoized: re-adding the same user (retries, reconciliation) reuses the bytes.
+    """
+    # VLESS Account, упакованный в TypedMessage (для User.account)
+    vless_account = account_pb2.Account(id=user_uuid, flow=flow)
+    user = user_pb2.User(
+        email=email,
+        level=0,
+        account=typed_message_pb2.TypedMessage(
+            type=_VLESS_ACCOUNT_TYPE,
+            value=vless_account.SerializeToString(),
+        ),
+    )
+
+    # AddUserOperation, упакованная в TypedMessage для AlterInbound
+    add_op = command_pb2.AddUserOperation(user=user)
+    request = command_pb2.AlterInboundRequest(
+        tag=tag,
+        operation=typed_message_pb2.TypedMessage(
+            type=_ADD_OP_TYPE,
+            value=add_op.SerializeToString(),
+        ),
+    )
+    return request.SerializeToString()
+
+
+@functools.lru_cache(maxsize=1024)
+def _serialize_remove_user(tag: str, email: str) -> bytes:
+    """Build serialized AlterInboundRequest with RemoveUserOperation (memoized)."""
+    # RemoveUserOperation, упакованная в TypedMessage для AlterInbound
+    remove_op = command_pb2.RemoveUserOperation(email=email)
+    request = command_pb2.AlterInboundRequest(
+        tag=tag,
+        operation=typed_message_pb2.TypedMessage(
+            type=_REMOVE_OP_TYPE,
+            value=remove_op.SerializeToString(),
+        ),
+    )
+    return request.SerializeToString()
+
+
+def _resolve_address(address: str, refresh: bool = False) -> str:
+    """Resolve host of a "host:port" address to an IP, cached per address.
+
+    Blocking (DNS lookup): call via asyncio.to_thread from async code.
+
+    Args:
+        address: Address in "host:port" form
+        refresh: Drop the cached IP and resolve again
+
+    Returns:
+        "ip:port", or the address as-is if the host can't be resolved
+    """
+    if not refresh and address in _resolved_addresses:
+        return _resolved_addresses[address]
+    host, _, port = address.rpartition(":")
+    try:
+        resolved = f"{socket.gethostbyname(host)}:{port}"
+    except OSError as e:
+        logger.debug("Failed to resolve XRay API host", host=host, error=str(e))
+        _resolved_addresses.pop(address, None)
+        return address
+    _resolved_addresses[address] = resolved
+    return resolved
+
+
 class XRayGRPCClient:
     """gRPC client for XRay HandlerService API.
 
-    Использует прямой gRPC вызов через Python grpc библиотеку.
+    Использует прямой асинхронный gRPC вызов (grpc.aio): вызовы add_user/
+    remove_user можно запускать параллельно через asyncio.gather, они
+    мультиплексируются по одному HTTP/2 соединению.
     Fallback на SIGHUP если gRPC недоступен.
     """
 
+    # Канал и вызовы общие на процесс (_channels), в экземпляре только адрес и кэш проверки
+    __slots__ = ("api_address", "grpc_address", "_availability")
+
     def __init__(self, api_address: str | None = None):
         """Initialize gRPC client.
 
@@ -48,18 +154,64 @@ class XRayGRPCClient:
         # Но мы в контейнере xray_agent, поэтому используем имя контейнера
         # Или можно использовать host.docker.internal если доступно
         self.grpc_address = self._get_grpc_address()
-        self._channel: grpc.Channel | None = None
-        self._stub: command_pb2_grpc.HandlerServiceStub | None = None
+        self._availability: tuple[float, bool] | None = None  # (monotonic time, result)
+
+    @property
+    def _stub(self) -> Any:
+        """Raw AlterInbound callable on the shared channel for this address (None if not connected)."""
+        entry = _channels.get(self.grpc_address)
+        return entry[1] if entry is not None else None
 
-        if PROTO_AVAILABLE:
+    async def _connect(self, reconnect: bool = False) -> None:
+        """Ensure a shared gRPC channel exists for this client's address.
+
+        Channels are process-wide (see _channels), so every client for the
+        same address reuses one connection.
+
+        Args:
+            reconnect: Close the existing channel and create a new one
+        """
+        entry = _channels.get(self.grpc_address)
+        if entry is not None:
+            if not reconnect:
+                return
+            del _channels[self.grpc_address]
+            await entry[0].close()
+        try:
+            # On reconnect the IP is resolved again: a recreated XRay container may get a new one.
+            # DNS lookup is blocking — resolve in a thread so a slow resolver doesn't stall the loop
+            target = await asyncio.to_thread(_resolve_address, self.grpc_address, reconnect)
+            channel = grpc.aio.insecure_channel(target, options=GRPC_CHANNEL_OPTIONS)
+            # No (de)serializers: requests are pre-serialized bytes, the response is unused
+            alter_inbound = channel.unary_unary(ALTER_INBOUND_METHOD)
+            _channels[self.grpc_address] = (channel, alter_inbound)
+            logger.debug("gRPC channel created", address=self.grpc_address, target=target)
+        except Exception as e:
+            logger.warning("Failed to create gRPC channel, will use fallback", error=str(e))
+
+    async def _alter_inbound(self, request: bytes, timeout: float | None = None) -> bytes:
+        """Call HandlerService.AlterInbound, reconnecting if XRay is UNAVAILABLE.
+
+        Args:
+            request: Serialized AlterInboundRequest (sent as-is on every attempt)
+            timeout: Per-attempt deadline in seconds (default: settings.xray_grpc_timeout_s)
+
+        Returns:
+            Raw AlterInboundResponse bytes (never parsed into a message)
+
+        Raises:
+            grpc.RpcError: If the call fails (UNAVAILABLE after GRPC_MAX_ATTEMPTS)
+        """
+        for attempt in range(GRPC_MAX_ATTEMPTS):
             try:
-                self._channel = grpc.insecure_channel(self.grpc_address)
-                self._stub = command_pb2_grpc.HandlerServiceStub(self._channel)
-                logger.debug("gRPC channel and stub created", address=self.grpc_address)
-            except Exception as e:
-                logger.warning("Failed to create gRPC channel, will use fallback", error=str(e))
-                self._channel = None
-                self._stub = None
+                return await self._stub(request, timeout=timeout or settings.xray_grpc_timeout_s)
+            except grpc.RpcError as e:
+                if e.code() != grpc.StatusCode.UNAVAILABLE or attempt == GRPC_MAX_ATTEMPTS - 1:
+                    raise
+                logger.warning("XRay gRPC unavailable, reconnecting", attempt=attempt + 1)
+                await self._connect(reconnect=True)
+                if self._stub is None:
+                    raise
 
     def _get_grpc_address(self) -> str:
         """Get gRPC server address.
@@ -77,61 +229,14 @@ class XRayGRPCClient:
             return addr
         return "homevpn_xray_server:10085"  # Через docker network (default)
 
-    def _call_xray_api_via_command(self, command: str, user_json: str) -> bool:
-        """Call XRay API using xray api command (adu/rmu).
-
-        Args:
-            command: Command name ("adu" for add user, "rmu" for remove user)
-            user_json: JSON string with user data
-
-        Returns:
-            True if successful, False otherwise
-        """
-        try:
-            # Имя контейнера из grpc_address (host:port -> host)
-            container_name = self.grpc_address.split(":")[0]
-            # Используем команду xray api adu/rmu через docker exec
-            # Формат: echo '{"email":"...","level":0,"account":{"id":"...","flow":"..."}}' | xray api adu vless
-            cmd = [
-                "docker",
-                "exec",
-                "-i",  # Interactive mode для stdin
-                container_name,
-                "xray",
-                "api",
-                command,
-                "vless",
-            ]
-
-            result = subprocess.run(
-                cmd,
-                input=user_json,
-                capture_output=True,
-                text=True,
-                timeout=10,
-            )
-
-            if result.returncode == 0:
-                logger.debug("XRay API command successful", command=command)
-                return True
-            else:
-                logger.error(
-                    "XRay API command failed",
-                    command=command,
-                    stderr=result.stderr,
-                    stdout=result.stdout,
-                    returncode=result.returncode,
-                )
-                return False
-
-        except subprocess.TimeoutExpired:
-            logger.error("XRay API command timeout", command=command)
-            return False
-        except Exception as e:
-            logger.error("Error calling XRay API command", command=command, error=str(e))
-            return False
-
-    def add_user(self, tag: str, user_uuid: str, email: str, flow: str = "xtls-rprx-vision") -> bool:
+    async def add_user(
+        self,
+        tag: str,
+        user_uuid: str,
+        email: str,
+        flow: str = "xtls-rprx-vision",
+        timeout: float | None = None,
+    ) -> bool:
         """Add user to XRay via HandlerService API using direct gRPC call.
 
         Args:
@@ -139,134 +244,126 @@ class XRayGRPCClient:
             user_uuid: UUID for VLESS user
             email: Email for user identification
             flow: Flow type (default: "xtls-rprx-vision")
+            timeout: Call deadline in seconds (default: settings.xray_grpc_timeout_s)
 
         Returns:
             True if successful, False otherwise
         """
-        if not PROTO_AVAILABLE or not self._stub:
+        if not PROTO_AVAILABLE:
+            logger.debug("gRPC not available, will use fallback", user_uuid=user_uuid)
+            return False
+        await self._connect()
+        if not self._stub:
             logger.debug("gRPC not available, will use fallback", user_uuid=user_uuid)
             return False
 
-        try:
-            # Создаем VLESS Account
-            vless_account = account_pb2.Account()
-            vless_account.id = user_uuid
-            vless_account.flow = flow
-
-            # Создаем TypedMessage для Account (для User.account)
-            # Используем полное имя типа БЕЗ префикса type.googleapis.com/
-            account_msg = typed_message_pb2.TypedMessage()
-            account_msg.type = vless_account.DESCRIPTOR.full_name
-            account_msg.value = vless_account.SerializeToString()
-
-            # Создаем User
-            user = user_pb2.User()
-            user.email = email
-            user.level = 0
-            user.account.CopyFrom(account_msg)
-
-            # Создаем AddUserOperation
-            add_op = command_pb2.AddUserOperation()
-            add_op.user.CopyFrom(user)
-
-            # Создаем TypedMessage для операции AlterInbound
-            # Используем полное имя типа БЕЗ префикса type.googleapis.com/
-            # XRay ожидает формат: xray.app.proxyman.command.AddUserOperation
-            operation_msg = typed_message_pb2.TypedMessage()
-            operation_msg.type = add_op.DESCRIPTOR.full_name
-            operation_msg.value = add_op.SerializeToString()
-
-            # Создаем AlterInboundRequest
-            request = command_pb2.AlterInboundRequest()
-            request.tag = tag
-            request.operation.CopyFrom(operation_msg)
-
-            # Вызываем gRPC метод
-            response = self._stub.AlterInbound(request, timeout=10)
-
-            logger.info("User added via direct gRPC API", user_uuid=user_uuid, email=email)
-            return True
+        request = _serialize_add_user(tag, user_uuid, email, flow)
 
+        # Вызываем gRPC метод (ответ пустой, не разбираем)
+        try:
+            await self._alter_inbound(request, timeout=timeout)
         except grpc.RpcError as e:
             logger.error("gRPC error adding user", user_uuid=user_uuid, error=str(e), code=e.code())
             return False
-        except Exception as e:
-            logger.error("Error adding user via gRPC API", user_uuid=user_uuid, error=str(e))
-            return False
 
-    def remove_user(self, tag: str, user_uuid: str, email: str | None = None) -> bool:
+        logger.info("User added via direct gRPC API", user_uuid=user_uuid, email=email)
+        return True
+
+    async def remove_user(
+        self,
+        tag: str,
+        user_uuid: str,
+        email: str | None = None,
+        timeout: float | None = None,
+    ) -> bool:
         """Remove user from XRay via HandlerService API using direct gRPC call.
 
         Args:
             tag: Inbound tag (usually "vless")
             user_uuid: UUID of user to remove
             email: Email of user (if None, will be found from config)
+            timeout: Call deadline in seconds (default: settings.xray_grpc_timeout_s)
 
         Returns:
             True if successful, False otherwise
         """
-        if not PROTO_AVAILABLE or not self._stub:
+        if not PROTO_AVAILABLE:
+            logger.debug("gRPC not available, will use fallback", user_uuid=user_uuid)
+            return False
+        await self._connect()
+        if not self._stub:
             logger.debug("gRPC not available, will use fallback", user_uuid=user_uuid)
             return False
 
-        try:
-            # Если email не передан, найти его по UUID из конфига
+        # Если email не передан, найти его по UUID из конфига
+        if not email:
+            email = await asyncio.to_thread(self._find_email_by_uuid, user_uuid, tag)
             if not email:
-                email = self._find_email_by_uuid(user_uuid, tag)
-                if not email:
-                    logger.warning("Could not find email for user UUID, using fallback", user_uuid=user_uuid)
-                    return False
+                logger.warning("Could not find email for user UUID, using fallback", user_uuid=user_uuid)
+                return False
 
-            # Создаем RemoveUserOperation
-            remove_op = command_pb2.RemoveUserOperation()
-            remove_op.email = email
+        request = _serialize_remove_user(tag, email)
 
-            # Создаем TypedMessage для операции AlterInbound
-            # Используем полное имя типа БЕЗ префикса type.googleapis.com/
-            # XRay ожидает формат: xray.app.proxyman.command.RemoveUserOperation
-            operation_msg = typed_message_pb2.TypedMessage()
-            operation_msg.type = remove_op.DESCRIPTOR.full_name
-            operation_msg.value = remove_op.SerializeToString()
+        # Вызываем gRPC метод (ответ пустой, не разбираем)
+        try:
+            await self._alter_inbound(request, timeout=timeout)
+        except grpc.RpcError as e:
+            logger.error("gRPC error removing user", user_uuid=user_uuid, error=str(e), code=e.code())
+            return False
 
-            # Создаем AlterInboundRequest
-            request = command_pb2.AlterInboundRequest()
-            request.tag = tag
-            request.operation.CopyFrom(operation_msg)
+        logger.info("User removed via direct gRPC API", user_uuid=user_uuid, email=email)
+        return True
 
-            # Вызываем gRPC метод
-            response = self._stub.AlterInbound(request, timeout=10)
+    async def add_users_batch(
+        self,
+        users: list[tuple[str, str, str]],
+        timeout: float | None = None,
+    ) -> list[bool]:
+        """Add several users concurrently over the shared channel.
 
-            logger.info("User removed via direct gRPC API", user_uuid=user_uuid, email=email)
-            return True
+        Args:
+            users: List of (tag, user_uuid, email)
+            timeout: Per-call deadline in seconds (default: settings.xray_grpc_timeout_s)
 
-        except grpc.RpcError as e:
-            logger.error("gRPC error removing user", user_uuid=user_uuid, error=str(e), code=e.code())
-            return False
-        except Exception as e:
-            logger.error("Error removing user via gRPC API", user_uuid=user_uuid, error=str(e))
-            return False
+        Returns:
+            add_user result for each user, in the same order
+        """
+        return list(await asyncio.gather(
+            *(
+                self.add_user(tag=tag, user_uuid=user_uuid, email=email, timeout=timeout)
+                for tag, user_uuid, email in users
+            )
+        ))
 
     def _find_email_by_uuid(self, user_uuid: str, tag: str = "vless") -> str | None:
         """Find user email by UUID from XRay config.
 
+        Uses a UUID -> email index over VLESS inbounds, rebuilt only when the
+        cached config changes (i.e. on config file mtime change).
+
         Args:
             user_uuid: UUID of user
-            tag: Inbound tag (usually "vless")
+            tag: Inbound tag (usually "vless"); kept for API compatibility,
+                users are looked up across VLESS inbounds
 
         Returns:
             Email if found, None otherwise
         """
+        global _uuid_index
+
         try:
-            from app.services.xray_manager import load_xray_config
-
-            config = load_xray_config()
-            for inbound in config.get("inbounds", []):
-                if inbound.get("tag") == tag or inbound.get("protocol") == "vless":
-                    clients = inbound.get("settings", {}).get("clients", [])
-                    for client in clients:
-                        if client.get("id") == user_uuid:
-                            return client.get("email")
-            return None
+            from app.services.xray_manager import load_xray_config_cached
+
+            config = load_xray_config_cached()
+            if _uuid_index is None or _uuid_index[0] is not config:
+                index: dict[str, str] = {}
+                for inbound in config.get("inbounds", []):
+                    if inbound.get("protocol") == "vless":
+                        for client in inbound.get("settings", {}).get("clients", []):
+                            if client.get("id") and client.get("email"):
+                                index.setdefault(client["id"], client["email"])
+                _uuid_index = (config, index)
+            return _uuid_index[1].get(user_uuid)
         except Exception as e:
             logger.error("Error finding email by UUID", user_uuid=user_uuid, error=str(e))
             return None
@@ -274,25 +371,40 @@ class XRayGRPCClient:
     def is_available(self) -> bool:
         """Проверить доступность gRPC API.
 
+        Результат TCP-проверки кэшируется на AVAILABILITY_CACHE_TTL секунд,
+        чтобы /status, метрики и add/remove подряд не открывали сокет каждый раз.
+
         Returns:
             True если API доступен, False иначе
         """
         if not PROTO_AVAILABLE:
             return False
 
-        try:
-            # Пробуем подключиться через socket
-            import socket
-            host, port = self.grpc_address.split(":")
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(2)
-            result = sock.connect_ex((host, int(port)))
-            sock.close()
-            return result == 0
+        cached = self._availability
+        now = time.monotonic()
+        if cached is not None and now - cached[0] < AVAILABILITY_CACHE_TTL:
+            return cached[1]
 
+        try:
+            # Пробуем подключиться через socket (по заранее разрешённому IP)
+            host, port = _resolve_address(self.grpc_address).rsplit(":", 1)
+            with socket.create_connection((host, int(port)), timeout=2):
+                available = True
         except Exception as e:
             logger.debug("Error checking gRPC availability", error=str(e))
-            return False
+            available = False
+            # IP мог смениться (контейнер пересоздан) — при следующей проверке разрешить заново
+            _resolved_addresses.pop(self.grpc_address, None)
+
+        self._availability = (now, available)
+        return available
+
+
+async def close_grpc_channels() -> None:
+    """Close all shared gRPC channels (on app shutdown)."""
+    while _channels:
+        _, (channel, _) = _channels.popitem()
+        await channel.close()
 
 
 # Глобальный экземпляр клиента
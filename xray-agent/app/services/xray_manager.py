@@ -1,15 +1,104 @@
 """XRay configuration management."""
-import json
+import base64
+import functools
+import os
+import re
+import shutil
 import subprocess
+import tempfile
+import time
 import uuid
+from datetime import datetime
 from pathlib import Path
 from typing import Any
 
+import httpx
+import orjson
+
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.core.reality_config import get_reality_short_id
 
 logger = get_logger(__name__)
 
+# XRay container start time: (started_at, fetched_at monotonic).
+# Cleared on restart; re-inspected after XRAY_STARTED_AT_MAX_AGE to catch restarts we didn't see.
+XRAY_STARTED_AT_MAX_AGE = 600.0
+_xray_started_at: tuple[datetime, float] | None = None
+
+# Short-lived XRay status snapshot shared by /status, /metrics and the periodic task
+XRAY_STATUS_TTL = 2.0
+_xray_status_cache: tuple[float, dict[str, Any]] | None = None
+
+# Parsed XRay config for read-only callers: ((st_mtime_ns, st_size), config). Reset on save.
+_xray_config_cache: tuple[tuple[int, int], dict[str, Any]] | None = None
+
+# Reality shortId: up to 8 bytes in hex (even length, may be empty)
+_SHORT_ID_RE = re.compile(r"(?:[0-9a-fA-F]{2}){0,8}")
+
+# Docker Engine API over the unix socket (no CLI fork); created lazily
+DOCKER_SOCKET_PATH = "/var/run/docker.sock"
+XRAY_CONTAINER_NAMES = ("homevpn_xray_server", "xray-server")
+_docker_client: httpx.Client | None = None
+
+# Container that runs `xray -test` for validation: (name or None, fetched_at monotonic)
+XRAY_CONTAINER_NAME_TTL = 60.0
+XRAY_VALIDATE_CONTAINER_PATTERNS = ("homevpn_xray_server_vpn_node", "homevpn_xray_server", "xray-server", "xray_server")
+_xray_container_name: tuple[str | None, float] | None = None
+
+# restart_xray autodiscovery: "<name> <image>" lines of docker ps that look like XRay
+_XRAY_IMAGE_RE = re.compile(r"xray|Xray|teddysun/xray")
+
+
+def _get_docker_client() -> httpx.Client:
+    """Get shared HTTP client bound to the Docker unix socket."""
+    global _docker_client
+    if _docker_client is None:
+        _docker_client = httpx.Client(
+            transport=httpx.HTTPTransport(uds=DOCKER_SOCKET_PATH),
+            base_url="http://localhost",
+            timeout=5.0,
+        )
+    return _docker_client
+
+
+def _docker_containers(filters: dict[str, list[str]] | None = None) -> list[dict[str, Any]]:
+    """List running containers via the Docker Engine API (`docker ps` without the CLI).
+
+    Args:
+        filters: Docker `filters` (e.g. {"name": ["xray"]}), None - all running
+
+    Returns:
+        Container summaries ("Id", "Names" with leading "/", "Image", ...),
+        empty if Docker is unreachable
+    """
+    params = {"filters": orjson.dumps(filters).decode()} if filters else None
+    try:
+        response = _get_docker_client().get("/containers/json", params=params)
+        response.raise_for_status()
+    except httpx.HTTPError as e:
+        logger.debug("Docker API container list failed", filters=filters, error=str(e))
+        return []
+    return response.json()
+
+
+def _docker_restart(container: str, timeout: float = 15) -> bool:
+    """Restart a container via the Docker Engine API (same socket the CLI uses, no fork).
+
+    Args:
+        container: Container name or ID
+        timeout: Request timeout in seconds (docker stops the container first)
+
+    Returns:
+        True if Docker accepted the restart
+    """
+    try:
+        response = _get_docker_client().post(f"/containers/{container}/restart", timeout=timeout)
+    except httpx.HTTPError as e:
+        logger.debug("Docker API restart failed", container=container, error=str(e))
+        return False
+    return response.status_code == 204
+
 
 def load_xray_config() -> dict[str, Any]:
     """Load XRay configuration from file.
@@ -19,22 +108,23 @@ def load_xray_config() -> dict[str, Any]:
 
     Raises:
         FileNotFoundError: If config file doesn't exist
-        json.JSONDecodeError: If config is invalid JSON
+        orjson.JSONDecodeError: If config is invalid JSON (subclass of json.JSONDecodeError)
     """
     config_path = Path(settings.xray_config_path)
     if not config_path.exists():
         logger.warning("XRay config file not found, creating default", path=str(config_path))
-        return get_default_config()
+        return get_default_config({})  # файла нет: пользователей переносить неоткуда
 
-    with open(config_path, "r", encoding="utf-8") as f:
-        config = json.load(f)
+    with open(config_path, "rb") as f:
+        config = orjson.loads(f.read())
 
     # Принудительно отключаем проверку разницы времени для Reality (maxTimeDiff=0).
     # Это снижает защиту от replay, но убирает ложные timeout при clock drift на клиентах.
     for inbound in config.get("inbounds", []):
         if inbound.get("protocol") == "vless":
-            reality = inbound.get("streamSettings", {}).get("realitySettings", {})
-            current = reality.get("maxTimeDiff")
+            reality = inbound.get("streamSettings", {}).get("realitySettings")
+            current = reality.get("maxTimeDiff") if reality is not None else 0
+            # Без realitySettings менять нечего: раньше здесь на каждый load шли save + reload
             if current != 0:
                 reality["maxTimeDiff"] = 0
                 logger.info("Forced maxTimeDiff %s→0 (disabled)", current)
@@ -49,82 +139,192 @@ def load_xray_config() -> dict[str, Any]:
     return config
 
 
+def load_xray_config_cached() -> dict[str, Any]:
+    """Load XRay configuration for read-only use.
+
+    The parsed config is reused until the file's mtime or size changes, so repeated
+    calls cost a single stat() syscall. The returned dict is shared between
+    callers and must not be modified; use load_xray_config to get a private
+    copy to edit and save.
+
+    Returns:
+        XRay configuration dictionary
+    """
+    global _xray_config_cache
+
+    config_path = Path(settings.xray_config_path)
+    try:
+        st = config_path.stat()
+    except FileNotFoundError:
+        return load_xray_config()
+
+    # Размер в ключе: на ФС с грубым mtime две записи подряд могут дать одинаковый mtime
+    key = (st.st_mtime_ns, st.st_size)
+    cached = _xray_config_cache
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    config = load_xray_config()
+    _xray_config_cache = (key, config)
+    return config
+
+
+def _is_x25519_key(key: str) -> bool:
+    """Check that key is URL-safe base64 (padding optional) of 32 bytes."""
+    try:
+        return len(base64.urlsafe_b64decode(key + "=" * (-len(key) % 4))) == 32
+    except (ValueError, TypeError):
+        return False
+
+
+def _check_config_structure(config: dict[str, Any]) -> str | None:
+    """Check the fields XRay rejects most often, without running xray.
+
+    Covers VLESS inbounds only: numeric port range, client UUIDs and Reality
+    settings (key length, shortId format, maxTimeDiff).
+
+    Args:
+        config: XRay configuration dictionary
+
+    Returns:
+        Error message for the first problem found, None if the config looks valid
+    """
+    inbounds = config.get("inbounds")
+    if not isinstance(inbounds, list):
+        return "inbounds must be a list"
+
+    for inbound in inbounds:
+        if inbound.get("protocol") != "vless":
+            continue
+        tag = inbound.get("tag")
+
+        # XRay принимает и строки ("443", "1000-2000", "env:PORT") — их оставляем xray -test
+        port = inbound.get("port")
+        if not isinstance(port, (int, str)) or (isinstance(port, int) and not 0 < port < 65536):
+            return f"inbound {tag}: invalid port {port!r}"
+
+        for client in inbound.get("settings", {}).get("clients", []):
+            try:
+                uuid.UUID(client["id"])
+            except (KeyError, TypeError, ValueError):
+                return f"inbound {tag}: invalid client id {client.get('id')!r}"
+
+        reality = inbound.get("streamSettings", {}).get("realitySettings")
+        if reality is None:
+            continue
+        # Пустой ключ не проверяем здесь: его отсутствие покажет xray -test
+        for key_name in ("privateKey", "publicKey"):
+            key = reality.get(key_name)
+            if key and not _is_x25519_key(key):
+                return f"inbound {tag}: {key_name} is not a 32-byte URL-safe base64 key"
+        for short_id in reality.get("shortIds", []):
+            if not isinstance(short_id, str) or not _SHORT_ID_RE.fullmatch(short_id):
+                return f"inbound {tag}: invalid shortId {short_id!r}"
+        max_time_diff = reality.get("maxTimeDiff", 0)
+        if not isinstance(max_time_diff, int) or max_time_diff < 0:
+            return f"inbound {tag}: invalid maxTimeDiff {max_time_diff!r}"
+
+    return None
+
+
+@functools.lru_cache(maxsize=None)
+def _resolve_executable(name: str) -> str:
+    """Resolve executable to an absolute path via PATH (name as-is if not found)."""
+    return shutil.which(name) or name
+
+
+def _spawn(args: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """subprocess.run() in a form CPython can start with posix_spawn.
+
+    posix_spawn is only used for an absolute executable path, close_fds=False
+    and no cwd/preexec_fn/start_new_session. Not closing fds is safe: Python
+    creates them non-inheritable (PEP 446), so the child gets only stdio.
+
+    Args:
+        args: Command argv; args[0] is looked up in PATH once
+        **kwargs: Passed to subprocess.run
+
+    Returns:
+        Completed process
+    """
+    return subprocess.run([_resolve_executable(args[0]), *args[1:]], close_fds=False, **kwargs)
+
+
+def _find_xray_container() -> str | None:
+    """Find the running XRay container name for docker exec.
+
+    One Docker API container list per XRAY_CONTAINER_NAME_TTL; the result,
+    including "not found", is cached in between.
+
+    Returns:
+        Container name, or None if no XRay container is running
+    """
+    global _xray_container_name
+
+    cached = _xray_container_name
+    if cached is not None and time.monotonic() - cached[1] < XRAY_CONTAINER_NAME_TTL:
+        return cached[0]
+
+    names = [c["Names"][0].lstrip("/") for c in _docker_containers({"name": ["xray"]}) if c.get("Names")]
+
+    # Try container names (docker compose may add project prefix: hv-node_homevpn_xray_server)
+    container_name = None
+    for pattern in XRAY_VALIDATE_CONTAINER_PATTERNS:
+        container_name = next((n for n in names if n.endswith(pattern)), None)
+        if container_name:
+            break
+
+    _xray_container_name = (container_name, time.monotonic())
+    return container_name
+
+
+def invalidate_xray_container() -> None:
+    """Forget the cached XRay container name (e.g. after exec into it failed)."""
+    global _xray_container_name
+    _xray_container_name = None
+
+
 def validate_xray_config(config: dict[str, Any]) -> tuple[bool, str | None]:
     """Validate XRay configuration before saving.
 
+    Structural checks run in-process first; only a config that passes them
+    is sent to `xray -test` inside the container (streamed via stdin).
+
     Args:
         config: XRay configuration dictionary
 
     Returns:
         Tuple of (is_valid: bool, error_message: str | None)
     """
+    error_msg = _check_config_structure(config)
+    if error_msg:
+        return False, error_msg
+
     try:
-        # Save config to temporary file for validation
-        import tempfile
-        import os
-        tmp_fd, tmp_path = tempfile.mkstemp(suffix='.json', text=True)
-        try:
-            with os.fdopen(tmp_fd, 'w') as tmp_file:
-                json.dump(config, tmp_file, indent=2, ensure_ascii=False)
-
-            # Copy temp file to container's filesystem for validation
-            # Try container names (docker compose may add project prefix: hv-node_homevpn_xray_server)
-            container_name = None
-            for pattern in ['homevpn_xray_server_vpn_node', 'homevpn_xray_server', 'xray-server', 'xray_server']:
-                result = subprocess.run(
-                    f"docker ps --format '{{{{.Names}}}}' | grep -E '{pattern}$' | head -1",
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                )
-                if result.returncode == 0 and result.stdout.strip():
-                    container_name = result.stdout.strip()
-                    break
-
-            if container_name:
-                # Copy temp file to container
-                container_tmp_path = f"/tmp/xray_config_validate_{os.getpid()}.json"
-                copy_result = subprocess.run(
-                    f"docker cp {tmp_path} {container_name}:{container_tmp_path}",
-                    shell=True,
-                    capture_output=True,
-                    text=True,
-                    timeout=5,
-                )
-
-                if copy_result.returncode == 0:
-                    # Validate using xray -test command inside container
-                    test_result = subprocess.run(
-                        f"docker exec {container_name} xray -test -config {container_tmp_path}",
-                        shell=True,
-                        capture_output=True,
-                        text=True,
-                        timeout=10,
-                    )
-
-                    # Clean up temp file in container
-                    subprocess.run(
-                        f"docker exec {container_name} rm -f {container_tmp_path}",
-                        shell=True,
-                        capture_output=True,
-                    )
-
-                    if test_result.returncode == 0:
-                        return True, None
-                    else:
-                        error_msg = test_result.stderr or test_result.stdout or "Unknown validation error"
-                        return False, error_msg
-                else:
-                    logger.warning("Failed to copy config to container for validation", error=copy_result.stderr)
-            else:
-                logger.warning("XRay container not found for validation")
-
-        finally:
-            # Clean up temporary file
-            try:
-                os.unlink(tmp_path)
-            except Exception:
-                pass
+        container_name = _find_xray_container()
+        if container_name:
+            # Одним docker exec: конфиг через stdin, без docker cp и rm временного файла
+            test_result = _spawn(
+                ["docker", "exec", "-i", container_name,
+                 "xray", "run", "-test", "-format", "json", "-config", "stdin:"],
+                input=orjson.dumps(config),
+                capture_output=True,
+                timeout=10,
+            )
+            if test_result.returncode == 0:
+                return True, None
+            if test_result.returncode in (125, 126, 127):
+                # Ошибка самого docker exec (контейнер пропал/пересоздан), а не конфига
+                invalidate_xray_container()
+                raise RuntimeError(test_result.stderr.decode("utf-8", "replace").strip())
+            # Вывод декодируем только при ошибке
+            error_msg = (
+                (test_result.stderr or test_result.stdout).decode("utf-8", "replace")
+                or "Unknown validation error"
+            )
+            return False, error_msg
+
+        logger.warning("XRay container not found for validation")
 
         # If validation mechanism fails, allow save but log warning
         logger.warning("Config validation skipped (container not available or validation failed)")
@@ -136,17 +336,34 @@ def validate_xray_config(config: dict[str, Any]) -> tuple[bool, str | None]:
         return True, None  # Allow save if validation mechanism fails
 
 
-def save_xray_config(config: dict[str, Any], validate: bool = True) -> None:
+def save_xray_config(config: dict[str, Any], validate: bool = True) -> bool:
     """Save XRay configuration to file.
 
+    Nothing is validated or written if the file already has exactly this content.
+
     Args:
         config: XRay configuration dictionary
         validate: Whether to validate config before saving (default: True)
 
+    Returns:
+        True if the file was written, False if it was already up to date
+
     Raises:
         ValueError: If config validation fails
         IOError: If file cannot be written
     """
+    global _xray_config_cache
+
+    data = orjson.dumps(config, option=orjson.OPT_INDENT_2)
+
+    config_path = Path(settings.xray_config_path)
+    try:
+        if config_path.read_bytes() == data:
+            logger.debug("XRay config unchanged, not saving", path=str(config_path))
+            return False
+    except FileNotFoundError:
+        pass
+
     # Validate config before saving
     if validate:
         is_valid, error_msg = validate_xray_config(config)
@@ -154,44 +371,62 @@ def save_xray_config(config: dict[str, Any], validate: bool = True) -> None:
             logger.error("XRay config validation failed", error=error_msg)
             raise ValueError(f"Invalid XRay configuration: {error_msg}")
 
-    config_path = Path(settings.xray_config_path)
     config_path.parent.mkdir(parents=True, exist_ok=True)
 
-    with open(config_path, "w", encoding="utf-8") as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    # Write to a temp file and rename so XRay (reload) and readers never see a
+    # truncated file; /etc/xray is a shared volume, so the rename is visible to XRay
+    try:
+        mode = config_path.stat().st_mode & 0o777
+    except FileNotFoundError:
+        mode = 0o644
+    fd, tmp_path = tempfile.mkstemp(dir=config_path.parent, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+            # Данные на диске до rename: после сбоя питания не останется пустого config.json
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)  # mkstemp creates 0600; keep file readable by XRay
+        os.replace(tmp_path, config_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    _xray_config_cache = None
 
     logger.info("XRay config saved", path=str(config_path))
+    return True
 
 
+@functools.lru_cache(maxsize=256)
 def _convert_private_key_to_hex(private_key_base64: str) -> str:
     """Convert private key from base64 to hex format for XRay.
 
+    Memoized: the node has one Reality key, so repeated conversions are a dict lookup.
+
     Args:
         private_key_base64: Private key in URL-safe base64 format (without padding)
 
     Returns:
         Private key in hex format (64 characters) for XRay config
     """
-    import base64
     try:
         # XRay Reality uses URL-safe base64 format (with _ and - instead of + and /)
-        # and without padding. We need to decode it properly.
-        # Add padding if needed for base64 decoding
-        padding = 4 - len(private_key_base64) % 4
-        if padding != 4:
-            private_key_base64 += '=' * padding
-
-        # Use urlsafe_b64decode to handle URL-safe base64 format
-        private_key_bytes = base64.urlsafe_b64decode(private_key_base64)
-        return private_key_bytes.hex()
+        # and without padding: restore the padding and decode
+        return base64.urlsafe_b64decode(private_key_base64 + "=" * (-len(private_key_base64) % 4)).hex()
     except Exception as e:
         logger.error("Failed to convert private key to hex", error=str(e))
         return ""
 
 
-def get_default_config() -> dict[str, Any]:
+def get_default_config(existing: dict[str, Any] | None = None) -> dict[str, Any]:
     """Get default XRay configuration with Reality support.
 
+    Args:
+        existing: Already parsed current config to take users from; if None,
+            the config file is read (if it exists)
+
     Returns:
         Default XRay configuration with Reality
     """
@@ -220,23 +455,25 @@ def get_default_config() -> dict[str, Any]:
         from app.utils.reality import generate_short_id
         short_id = generate_short_id()
         short_ids = [short_id]
-        reality_config["short_ids"] = short_ids
         from app.core.reality_config import save_reality_config
-        save_reality_config(reality_config)
+        # Copy: the loaded dict is the shared cache entry
+        save_reality_config({**reality_config, "short_ids": short_ids})
 
     # Preserve existing users from current config if it exists
     existing_clients = []
     try:
-        config_path = Path(settings.xray_config_path)
-        if config_path.exists():
-            with open(config_path, "r", encoding="utf-8") as f:
-                existing_config = json.load(f)
-            # Extract clients from existing VLESS inbound
-            for inbound in existing_config.get("inbounds", []):
-                if inbound.get("protocol") == "vless":
-                    existing_clients = inbound.get("settings", {}).get("clients", [])
-                    logger.info("Preserving existing users in default config", users_count=len(existing_clients))
-                    break
+        existing_config = existing
+        if existing_config is None:
+            try:
+                existing_config = orjson.loads(Path(settings.xray_config_path).read_bytes())
+            except FileNotFoundError:
+                existing_config = {}
+        # Extract clients from existing VLESS inbound
+        for inbound in existing_config.get("inbounds", []):
+            if inbound.get("protocol") == "vless":
+                existing_clients = inbound.get("settings", {}).get("clients", [])
+                logger.info("Preserving existing users in default config", users_count=len(existing_clients))
+                break
     except Exception as e:
         logger.warning("Failed to load existing config to preserve users", error=str(e))
         # Continue with empty clients list if config is corrupted
@@ -326,18 +563,35 @@ def get_default_config() -> dict[str, Any]:
     }
 
 
-def add_user_to_config(user_uuid: str, email: str | None = None) -> tuple[bool, str | None]:
-    """Add user to XRay configuration.
+def _vless_client(user_uuid: str, email: str | None) -> dict[str, str]:
+    """Build the VLESS client entry the agent writes for a user."""
+    return {
+        "id": user_uuid,
+        "email": email or f"user-{user_uuid[:8]}",
+        "flow": "xtls-rprx-vision",  # Used with Reality (as competitor config shows)
+    }
+
+
+def apply_user_diff(
+    adds: list[tuple[str, str | None]],
+    removes: list[str],
+) -> dict[str, bool] | None:
+    """Add and remove several users with one config load and one save.
+
+    Removals are applied first, so a UUID can be replaced in one call. XRay is
+    NOT reloaded here: callers reload (or push via gRPC) once per batch.
 
     Args:
-        user_uuid: UUID for VLESS user
-        email: Optional email for user identification
+        adds: List of (user_uuid, email); email defaults to "user-<uuid[:8]>"
+        removes: UUIDs of users to remove
 
     Returns:
-        Tuple of (success, short_id):
-        - success: True if user added successfully, False if user already exists
-        - short_id: Reality short ID for this user (if Reality is enabled)
+        UUID -> whether the config changed for it (False: already present or
+        not found), or None if the VLESS inbound is missing
     """
+    # Ленивый импорт: user_cache сам импортирует этот модуль
+    from app.services.user_cache import user_cache as _user_cache
+
     config = load_xray_config()
 
     # Find VLESS inbound
@@ -349,53 +603,79 @@ def add_user_to_config(user_uuid: str, email: str | None = None) -> tuple[bool,
 
     if not vless_inbound:
         logger.error("VLESS inbound not found in config")
-        return False, None
+        return None
+
+    original_clients = vless_inbound.get("settings", {}).get("clients", [])
+    clients = original_clients
+    result: dict[str, bool] = {}
+    removed_count = 0
+
+    if removes and adds:
+        # Remove + add of an identical client (e.g. regenerate with old == new UUID) is a no-op
+        current = {c.get("id"): c for c in clients}
+        unchanged = {u for u, email in adds if u in current and current[u] == _vless_client(u, email)}
+        if unchanged:
+            removes = [u for u in removes if u not in unchanged]
+            adds = [a for a in adds if a[0] not in unchanged]
+            result.update(dict.fromkeys(unchanged, False))
+
+    if removes:
+        remove_set = set(removes)
+        present = {c.get("id") for c in clients}
+        clients = [c for c in clients if c.get("id") not in remove_set]
+        removed_count = len(present & remove_set)
+        for user_uuid in removes:
+            result[user_uuid] = user_uuid in present
+
+    added: dict[str, dict[str, str]] = {}  # email -> new client
+    if adds:
+        existing = {c.get("id") for c in clients}
+        for user_uuid, email in adds:
+            if user_uuid in existing:
+                logger.info("User already exists in XRay config - this is OK", user_uuid=user_uuid)
+                result[user_uuid] = False
+                continue
+            client = _vless_client(user_uuid, email)
+            added[client["email"]] = client
+        # XRay doesn't allow duplicate emails: drop other clients with the same email
+        clients = [c for c in clients if c.get("email") not in added]
+        clients.extend(added.values())
+        for client in added.values():
+            result[client["id"]] = True
+
+    if not any(result.values()) or clients == original_clients:
+        return result
+
+    vless_inbound.setdefault("settings", {})["clients"] = clients
+    save_xray_config(config)
 
-    clients = vless_inbound.get("settings", {}).get("clients", [])
-
-    # Check if user already exists (by UUID)
-    for client in clients:
-        if client.get("id") == user_uuid:
-            logger.info("User already exists in XRay config - this is OK", user_uuid=user_uuid)
-            # Try to get existing short_id from Reality config
-            from app.core.reality_config import get_reality_config
-            reality_config = get_reality_config()
-            short_ids = reality_config.get("short_ids", [])
-            existing_short_id = short_ids[0] if short_ids else None
-            # User already exists - this is OK, return True to indicate success
-            return True, existing_short_id
-
-    # Remove any duplicate emails before adding (XRay doesn't allow duplicate emails)
-    email_to_use = email or f"user-{user_uuid[:8]}"
-    # Remove clients with same email but different UUID (keep only the one with matching UUID)
-    clients = [c for c in clients if not (c.get("email") == email_to_use and c.get("id") != user_uuid)]
-
-    # Add new user with Reality flow
-    # Use existing short_id from config (no need to generate new one)
-    from app.core.reality_config import get_reality_config
-
-    # Get existing short_id from Reality config (use first one)
-    reality_config = get_reality_config()
-    short_ids = reality_config.get("short_ids", [])
-    short_id = short_ids[0] if short_ids else None
+    # Update cache
+    for user_uuid in removes:
+        _user_cache.remove(user_uuid)
+    for client in added.values():
+        _user_cache.add(client["id"])
 
-    # No need to update shortIds in XRay config - they don't change
-    logger.debug("Using existing short_id", short_id=short_id)
+    logger.info("XRay config users updated", added=len(added), removed=removed_count)
+    return result
 
-    new_client = {
-        "id": user_uuid,
-        "email": email_to_use,
-        "flow": "xtls-rprx-vision",  # Used with Reality (as competitor config shows)
-    }
-    clients.append(new_client)
-    vless_inbound["settings"]["clients"] = clients
 
-    save_xray_config(config)
-    logger.info("User added to XRay config", user_uuid=user_uuid, email=email, short_id=short_id)
+def add_user_to_config(user_uuid: str, email: str | None = None) -> tuple[bool, str | None]:
+    """Add user to XRay configuration.
 
-    # Update cache
-    user_cache.add(user_uuid)
+    Args:
+        user_uuid: UUID for VLESS user
+        email: Optional email for user identification
+
+    Returns:
+        Tuple of (success, short_id):
+        - success: True if user added or already present, False if VLESS inbound is missing
+        - short_id: Reality short ID for this user (if Reality is enabled)
+    """
+    if apply_user_diff([(user_uuid, email)], []) is None:
+        return False, None
 
+    short_id = get_reality_short_id()
+    logger.info("User added to XRay config", user_uuid=user_uuid, email=email, short_id=short_id)
     return True, short_id
 
 
@@ -408,31 +688,13 @@ def remove_user_from_config(user_uuid: str) -> bool:
     Returns:
         True if user removed successfully, False if user not found
     """
-    config = load_xray_config()
-
-    # Find VLESS inbound
-    vless_inbound = None
-    for inbound in config.get("inbounds", []):
-        if inbound.get("protocol") == "vless":
-            vless_inbound = inbound
-            break
-
-    if not vless_inbound:
-        logger.error("VLESS inbound not found in config")
+    result = apply_user_diff([], [user_uuid])
+    if not result:
         return False
-
-    clients = vless_inbound.get("settings", {}).get("clients", [])
-
-    # Remove user
-    original_count = len(clients)
-    clients[:] = [c for c in clients if c.get("id") != user_uuid]
-
-    if len(clients) == original_count:
+    if not result[user_uuid]:
         logger.warning("User not found in config", user_uuid=user_uuid)
         return False
 
-    vless_inbound["settings"]["clients"] = clients
-    save_xray_config(config)
     logger.info("User removed from XRay config", user_uuid=user_uuid)
     return True
 
@@ -451,51 +713,13 @@ def regenerate_user_in_config(old_user_uuid: str, new_user_uuid: str, email: str
     Returns:
         Tuple of (success: bool, short_id: str | None)
     """
-    config = load_xray_config()
-
-    # Find VLESS inbound
-    vless_inbound = None
-    for inbound in config.get("inbounds", []):
-        if inbound.get("protocol") == "vless":
-            vless_inbound = inbound
-            break
-
-    if not vless_inbound:
-        logger.error("VLESS inbound not found in config")
+    result = apply_user_diff([(new_user_uuid, email)], [old_user_uuid])
+    if result is None:
         return False, None
-
-    clients = vless_inbound.get("settings", {}).get("clients", [])
-
-    # Remove old user (if exists)
-    original_count = len(clients)
-    clients[:] = [c for c in clients if c.get("id") != old_user_uuid]
-    removed = len(clients) < original_count
-    if removed:
-        logger.info("Old user removed from config", old_user_uuid=old_user_uuid)
-    else:
+    if not result.get(old_user_uuid):
         logger.debug("Old user not found in config (may not exist)", old_user_uuid=old_user_uuid)
 
-    # Add new user with Reality flow
-    # Use existing short_id from config (no need to generate new one)
-    from app.core.reality_config import get_reality_config
-
-    # Get existing short_id from Reality config (use first one)
-    reality_config = get_reality_config()
-    short_ids = reality_config.get("short_ids", [])
-    short_id = short_ids[0] if short_ids else None
-
-    # No need to update shortIds in XRay config - they don't change
-    logger.debug("Using existing short_id", short_id=short_id)
-
-    new_client = {
-        "id": new_user_uuid,
-        "email": email or f"user-{new_user_uuid[:8]}",
-        # Note: flow parameter is not used for Reality protocol
-    }
-    clients.append(new_client)
-    vless_inbound["settings"]["clients"] = clients
-
-    save_xray_config(config)
+    short_id = get_reality_short_id()
     logger.info(
         "User regenerated in XRay config",
         old_user_uuid=old_user_uuid,
@@ -503,12 +727,20 @@ def regenerate_user_in_config(old_user_uuid: str, new_user_uuid: str, email: str
         email=email,
         short_id=short_id,
     )
+    return True, short_id
 
-    # Update cache
-    user_cache.remove(old_user_uuid)
-    user_cache.add(new_user_uuid)
 
-    return True, short_id
+def _run_command(args: list[str], timeout: float = 60) -> tuple[bool, str]:
+    """Run a command (argv list, no shell) and return (success, combined_output).
+
+    A missing executable (e.g. no docker CLI) counts as a failed command.
+    """
+    try:
+        result = _spawn(args, capture_output=True, text=True, timeout=timeout)
+    except FileNotFoundError as e:
+        return False, str(e)
+    output = "\n".join([x for x in [result.stdout, result.stderr] if x]).strip()
+    return result.returncode == 0, output
 
 
 def reload_xray() -> bool:
@@ -520,16 +752,20 @@ def reload_xray() -> bool:
     try:
         result = subprocess.run(
             settings.xray_reload_command,
-            shell=True,
+            shell=True,  # настраиваемая команда из env, может содержать && и ||
+            close_fds=False,  # /bin/sh по абсолютному пути: запуск через posix_spawn (см. _spawn)
             capture_output=True,
-            text=True,
             timeout=30,
         )
         if result.returncode == 0:
             logger.info("XRay reloaded successfully")
             return True
         else:
-            logger.error("XRay reload failed", stderr=result.stderr, stdout=result.stdout)
+            logger.error(
+                "XRay reload failed",
+                stderr=result.stderr.decode("utf-8", "replace"),
+                stdout=result.stdout.decode("utf-8", "replace"),
+            )
             return False
     except subprocess.TimeoutExpired:
         logger.error("XRay reload timeout")
@@ -545,38 +781,23 @@ def restart_xray() -> bool:
     Returns:
         True if restart successful, False otherwise
     """
-    def _run(command: str, timeout: int = 60) -> tuple[bool, str]:
-        """Run shell command and return (success, combined_output)."""
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-        )
-        output = "\n".join([x for x in [result.stdout, result.stderr] if x]).strip()
-        return result.returncode == 0, output
-
     def _sync_user_cache() -> None:
-        """Refresh in-memory cache after restart/reload."""
+        """Refresh in-memory caches after restart/reload."""
         from app.services.user_cache import user_cache as _user_cache
+        invalidate_xray_started_at()
+        invalidate_xray_status()
         _user_cache.mark_xray_reloaded()
         _user_cache.sync_from_config()
 
     try:
-        # 1) Docker API via curl (most reliable, same as restart_agent)
+        # 1) Docker API over the unix socket (most reliable, same as restart_agent)
         for name in [
             "homevpn_xray_server",
             "homevpn_xray_server_vpn_node",
             "xray-server",
             "xray_server",
         ]:
-            ok, _ = _run(
-                f'curl -sf --unix-socket /var/run/docker.sock '
-                f'-X POST "http://localhost/v1.53/containers/{name}/restart"',
-                timeout=15,
-            )
-            if ok:
+            if _docker_restart(name):
                 logger.info("XRay container restarted via API", container=name)
                 _sync_user_cache()
                 return True
@@ -588,7 +809,7 @@ def restart_xray() -> bool:
             "xray-server",
             "xray_server",
         ]:
-            ok, out = _run(f"docker restart {name}", timeout=40)
+            ok, out = _run_command(["docker", "restart", name], timeout=40)
             if ok:
                 logger.info("XRay container restarted", container=name)
                 _sync_user_cache()
@@ -597,22 +818,20 @@ def restart_xray() -> bool:
                 logger.debug("Restart attempt failed", container=name, output=out[:200])
 
         # 3) Autodiscovery by image/name
-        ok, discovered = _run(
-            "docker ps --format '{{.Names}} {{.Image}}' | awk '/xray|Xray|teddysun\\/xray/ {print $1; exit}'",
-            timeout=10,
+        container_name = next(
+            (
+                c["Names"][0].lstrip("/")
+                for c in _docker_containers()
+                if c.get("Names") and _XRAY_IMAGE_RE.search(f'{c["Names"][0]} {c.get("Image", "")}')
+            ),
+            "",
         )
-        container_name = discovered.strip() if ok else ""
         if container_name:
-            ok, _ = _run(
-                f'curl -sf --unix-socket /var/run/docker.sock '
-                f'-X POST "http://localhost/v1.53/containers/{container_name}/restart"',
-                timeout=15,
-            )
-            if ok:
+            if _docker_restart(container_name):
                 logger.info("XRay container restarted via API (discovered)", container=container_name)
                 _sync_user_cache()
                 return True
-            ok, out = _run(f"docker restart {container_name}", timeout=40)
+            ok, out = _run_command(["docker", "restart", container_name], timeout=40)
             if ok:
                 logger.info("XRay container restarted (discovered)", container=container_name)
                 _sync_user_cache()
@@ -620,7 +839,7 @@ def restart_xray() -> bool:
 
         # 4) Fallback to service manager (non-docker setups)
         for svc_cmd in ["systemctl restart xray", "service xray restart"]:
-            ok, out = _run(svc_cmd, timeout=40)
+            ok, out = _run_command(svc_cmd.split(), timeout=40)
             if ok:
                 logger.info("XRay service restarted", command=svc_cmd)
                 _sync_user_cache()
@@ -650,34 +869,16 @@ def restart_agent() -> bool:
     Returns:
         True if restart was initiated successfully
     """
-    def _run(command: str, timeout: int = 15) -> tuple[bool, str]:
-        result = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=timeout,
-        )
-        output = "\n".join([x for x in [result.stdout, result.stderr] if x]).strip()
-        return result.returncode == 0, output
-
     try:
-        # 1) Docker API via curl (most reliable, works with :ro socket)
+        # 1) Docker API over the unix socket (most reliable, works with :ro socket)
         for name in ["homevpn_xray_agent", "xray-agent", "xray_agent"]:
-            ok, out = _run(
-                f'curl -sf --unix-socket /var/run/docker.sock '
-                f'-X POST "http://localhost/v1.53/containers/{name}/restart"',
-                timeout=15,
-            )
-            if ok:
+            if _docker_restart(name):
                 logger.info("Agent container restarted via API", container=name)
                 return True
-            if out:
-                logger.debug("API restart attempt", container=name, output=out[:200])
 
         # 2) docker CLI
         for name in ["homevpn_xray_agent", "xray-agent", "xray_agent"]:
-            ok, out = _run(f"docker restart {name}", timeout=30)
+            ok, out = _run_command(["docker", "restart", name], timeout=30)
             if ok:
                 logger.info("Agent container restarted", container=name)
                 return True
@@ -685,20 +886,15 @@ def restart_agent() -> bool:
                 logger.debug("CLI restart attempt", container=name, output=out[:200])
 
         # 3) Find by filter
-        for filter_arg in [
-            "--filter label=com.docker.compose.service=xray-agent",
-            "--filter name=xray-agent",
-            "--filter name=xray_agent",
+        for filters in [
+            {"label": ["com.docker.compose.service=xray-agent"]},
+            {"name": ["xray-agent"]},
+            {"name": ["xray_agent"]},
         ]:
-            ok, out = _run(f"docker ps -q {filter_arg}", timeout=10)
-            if ok and out.strip():
-                cid = out.strip().split("\n")[0]
-                ok, _ = _run(
-                    f'curl -sf --unix-socket /var/run/docker.sock '
-                    f'-X POST "http://localhost/v1.53/containers/{cid}/restart"',
-                    timeout=15,
-                )
-                if ok:
+            containers = _docker_containers(filters)
+            if containers:
+                cid = containers[0]["Id"][:12]
+                if _docker_restart(cid):
                     logger.info("Agent container restarted via API", container=cid)
                     return True
 
@@ -709,9 +905,80 @@ def restart_agent() -> bool:
         return False
 
 
+def get_xray_started_at() -> datetime | None:
+    """Get XRay container start time.
+
+    Queries the Docker Engine API over the unix socket (no `docker` CLI fork)
+    only on a cache miss; the result is reused until a restart clears it or
+    it is older than XRAY_STARTED_AT_MAX_AGE.
+    Blocking: call via asyncio.to_thread from async code.
+
+    Returns:
+        Container start time, or None if it could not be determined
+    """
+    global _xray_started_at
+
+    cached = _xray_started_at
+    if cached is not None and time.monotonic() - cached[1] < XRAY_STARTED_AT_MAX_AGE:
+        return cached[0]
+
+    if not Path(DOCKER_SOCKET_PATH).exists():
+        logger.debug("Docker socket not available, XRay start time unknown")
+        return None
+
+    client = _get_docker_client()
+    for name in XRAY_CONTAINER_NAMES:
+        try:
+            response = client.get(f"/containers/{name}/json")
+            if response.status_code != 200:
+                continue
+            raw = response.json().get("State", {}).get("StartedAt", "")
+            if not raw:
+                continue
+            started_at = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+            _xray_started_at = (started_at, time.monotonic())
+            return started_at
+        except Exception as e:
+            logger.debug("Failed to get XRay container start time", container=name, error=str(e))
+
+    return None
+
+
+def invalidate_xray_started_at() -> None:
+    """Forget cached XRay container start time (call after a restart)."""
+    global _xray_started_at
+    _xray_started_at = None
+
+
 def get_xray_status() -> dict[str, Any]:
     """Get XRay status.
 
+    Results are cached for XRAY_STATUS_TTL seconds so bursts of callers
+    share a single probe.
+
+    Returns:
+        Dictionary with XRay status information
+    """
+    global _xray_status_cache
+
+    cached = _xray_status_cache
+    if cached is not None and time.monotonic() - cached[0] < XRAY_STATUS_TTL:
+        return dict(cached[1])
+
+    status_info = _collect_xray_status()
+    _xray_status_cache = (time.monotonic(), status_info)
+    return dict(status_info)
+
+
+def invalidate_xray_status() -> None:
+    """Forget cached XRay status (call after restart/reload)."""
+    global _xray_status_cache
+    _xray_status_cache = None
+
+
+def _collect_xray_status() -> dict[str, Any]:
+    """Probe XRay and count users (uncached).
+
     Returns:
         Dictionary with XRay status information
     """
@@ -730,21 +997,18 @@ def get_xray_status() -> dict[str, Any]:
         # Fallback: check if config file exists and is valid
         try:
             if config_exists:
-                config = load_xray_config()
+                config = load_xray_config_cached()
                 xray_running = bool(config.get("inbounds"))
         except Exception:
             pass
 
-    # Count users
+    # Count users: user_cache is kept in step with every add/remove and
+    # re-synced from the config periodically, so no config walk per status call
     users_count = 0
     if config_exists:
         try:
-            config = load_xray_config()
-            for inbound in config.get("inbounds", []):
-                if inbound.get("protocol") == "vless":
-                    clients = inbound.get("settings", {}).get("clients", [])
-                    users_count = len(clients)
-                    break
+            from app.services.user_cache import user_cache as _user_cache
+            users_count = _user_cache.count()
         except Exception:
             pass
 
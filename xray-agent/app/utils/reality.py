@@ -5,6 +5,7 @@ from typing import Tuple
 
 try:
     from cryptography.hazmat.primitives.asymmetric.x25519 import X25519PrivateKey
+    _x25519_generate = X25519PrivateKey.generate
     CRYPTO_AVAILABLE = True
 except ImportError:
     CRYPTO_AVAILABLE = False
@@ -14,6 +15,36 @@ from app.core.logging import get_logger
 logger = get_logger(__name__)
 
 
+DEFAULT_FINGERPRINTS: tuple[str, ...] = (
+    "chrome",
+    "firefox",
+    "safari",
+    "edge",
+    "ios",
+    "android",
+    "random",
+    "randomized",
+)
+
+DEFAULT_SNI_LIST: tuple[str, ...] = (
+    "nltimes.nl",
+    "www.microsoft.com",
+    "www.apple.com",
+    "www.google.com",
+    "www.cloudflare.com",
+    "www.amazon.com",
+    "www.github.com",
+    "www.stackoverflow.com",
+)
+
+DEFAULT_SPX = "/"
+
+
+def _b64url_nopad(data: bytes) -> str:
+    """Encode bytes as URL-safe base64 without '=' padding (format of 'xray x25519')."""
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
 def generate_reality_keys() -> Tuple[str, str]:
     """Generate Reality public and private keys using X25519 curve.
 
@@ -27,7 +58,7 @@ def generate_reality_keys() -> Tuple[str, str]:
     """
     if CRYPTO_AVAILABLE:
         # Use X25519 curve for proper key generation
-        private_key_obj = X25519PrivateKey.generate()
+        private_key_obj = _x25519_generate()
         public_key_obj = private_key_obj.public_key()
 
         # Get raw bytes (32 bytes each)
@@ -37,8 +68,8 @@ def generate_reality_keys() -> Tuple[str, str]:
         # XRay requires URL-safe base64 format without padding (same as output of 'xray x25519' command)
         # The 'xray x25519' command outputs keys in URL-safe base64 format (uses _ and - instead of + and /)
         # and without '=' padding
-        public_key = base64.urlsafe_b64encode(public_key_bytes).decode('utf-8').rstrip('=')
-        private_key = base64.urlsafe_b64encode(private_key_bytes).decode('utf-8').rstrip('=')
+        public_key = _b64url_nopad(public_key_bytes)
+        private_key = _b64url_nopad(private_key_bytes)
 
         logger.debug("Generated Reality keys using cryptography", public_key_length=len(public_key), private_key_length=len(private_key))
     else:
@@ -48,8 +79,8 @@ def generate_reality_keys() -> Tuple[str, str]:
         public_key_bytes = secrets.token_bytes(32)
 
         # Use URL-safe base64 without padding (same format as XRay expects)
-        public_key = base64.urlsafe_b64encode(public_key_bytes).decode('utf-8').rstrip('=')
-        private_key = base64.urlsafe_b64encode(private_key_bytes).decode('utf-8').rstrip('=')
+        public_key = _b64url_nopad(public_key_bytes)
+        private_key = _b64url_nopad(private_key_bytes)
 
         logger.warning("Using random bytes - keys may not work correctly with XRay Reality")
 
@@ -62,48 +93,29 @@ def generate_short_id() -> str:
     Returns:
         Short ID as hex string (6 characters)
     """
-    # Generate 3 random bytes = 6 hex characters (matches competitor format)
-    short_id_bytes = secrets.token_bytes(3)
-    short_id = short_id_bytes.hex()
+    # 3 random bytes = 6 hex characters (matches competitor format)
+    short_id = secrets.token_hex(3)
 
     logger.debug("Generated short ID", short_id=short_id)
     return short_id
 
 
-def get_default_fingerprints() -> list[str]:
-    """Get list of default fingerprints for Reality.
+def get_default_fingerprints() -> tuple[str, ...]:
+    """Get default fingerprints for Reality.
 
     Returns:
-        List of fingerprint options
+        Fingerprint options (shared immutable tuple)
     """
-    return [
-        "chrome",
-        "firefox",
-        "safari",
-        "edge",
-        "ios",
-        "android",
-        "random",
-        "randomized",
-    ]
+    return DEFAULT_FINGERPRINTS
 
 
-def get_default_sni_list() -> list[str]:
-    """Get list of default SNI (Server Name Indication) for Reality masquerading.
+def get_default_sni_list() -> tuple[str, ...]:
+    """Get default SNI (Server Name Indication) for Reality masquerading.
 
     Returns:
-        List of SNI options (popular legitimate services)
+        SNI options, popular legitimate services (shared immutable tuple)
     """
-    return [
-        "nltimes.nl",
-        "www.microsoft.com",
-        "www.apple.com",
-        "www.google.com",
-        "www.cloudflare.com",
-        "www.amazon.com",
-        "www.github.com",
-        "www.stackoverflow.com",
-    ]
+    return DEFAULT_SNI_LIST
 
 
 def get_default_spx() -> str:
@@ -112,4 +124,4 @@ def get_default_spx() -> str:
     Returns:
         Default service path
     """
-    return "/"
+    return DEFAULT_SPX
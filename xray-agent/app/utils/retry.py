@@ -1,5 +1,7 @@
 """Retry utilities for API calls."""
 import asyncio
+import random
+import time
 from typing import Callable, TypeVar, Any
 from functools import wraps
 
@@ -16,27 +18,43 @@ async def retry_with_backoff(
     initial_delay: float = 1.0,
     backoff_factor: float = 2.0,
     *args,
+    max_delay: float | None = None,
+    jitter: float = 0.0,
+    should_retry: Callable[[Exception], bool] | None = None,
+    deadline: float | None = None,
     **kwargs
 ) -> T | None:
     """Retry function with exponential backoff.
 
+    Delay before retry N (0-based) is
+    min(max_delay, initial_delay * backoff_factor**N) * (1 + uniform(0, jitter)),
+    so agents failing at the same moment don't retry in lock-step. With a
+    deadline, no retry is scheduled that would start after it.
+
     Args:
         func: Async function to retry
         max_retries: Maximum number of retries
         initial_delay: Initial delay in seconds
         backoff_factor: Backoff multiplier
         *args: Positional arguments for func
+        max_delay: Upper bound for the un-jittered delay (None - no cap)
+        jitter: Max extra fraction of the delay added at random
+        should_retry: Predicate for recoverable errors; others are re-raised
+            immediately (None - retry every exception)
+        deadline: time.monotonic() value after which the last error is
+            re-raised instead of retrying (None - no deadline)
         **kwargs: Keyword arguments for func
 
     Returns:
         Function result or None if all retries failed
     """
-    delay = initial_delay
-
     for attempt in range(max_retries):
         try:
             return await func(*args, **kwargs)
         except Exception as e:
+            if should_retry is not None and not should_retry(e):
+                raise  # Not recoverable, retrying won't help
+
             if attempt == max_retries - 1:
                 logger.error(
                     "Max retries reached",
@@ -46,6 +64,20 @@ async def retry_with_backoff(
                 )
                 raise  # Re-raise on final attempt
 
+            delay = initial_delay * backoff_factor ** attempt
+            if max_delay is not None:
+                delay = min(max_delay, delay)
+            if jitter:
+                delay *= 1 + random.uniform(0, jitter)
+            if deadline is not None and time.monotonic() + delay > deadline:
+                logger.error(
+                    "Retry deadline reached",
+                    function=func.__name__,
+                    error=str(e),
+                    attempts=attempt + 1
+                )
+                raise  # Next attempt would start past the deadline
+
             logger.warning(
                 "Retry attempt",
                 function=func.__name__,
@@ -55,6 +87,5 @@ async def retry_with_backoff(
                 error=str(e)
             )
             await asyncio.sleep(delay)
-            delay *= backoff_factor
 
     return None
@@ -4,8 +4,8 @@
 
 if [ "$ENVIRONMENT" = "production" ] || [ "$ENVIRONMENT" = "prod" ]; then
     echo "🚀 Starting in PRODUCTION mode with single worker..."
-    exec uvicorn app.main:app --host 0.0.0.0 --port 8080 --workers 1
+    exec uvicorn app.main:app --host 0.0.0.0 --port 8080 --workers 1 --loop uvloop
 else
     echo "🔧 Starting in DEVELOPMENT mode with reload..."
-    exec uvicorn app.main:app --host 0.0.0.0 --port 8080 --reload
+    exec uvicorn app.main:app --host 0.0.0.0 --port 8080 --reload --loop uvloop
 fi
@@ -0,0 +1,56 @@
+"""Tests for the 400 contracts of POST /commands validation errors."""
+import pytest
+from fastapi.testclient import TestClient
+
+from app.core.security import verify_api_key
+from app.main import app
+
+VALID_UUID = "123e4567-e89b-12d3-a456-426614174000"
+
+
+@pytest.fixture
+def client():
+    # Без `with`: lifespan (XRay, Core API) в этих тестах не нужен
+    app.dependency_overrides[verify_api_key] = lambda: "test"
+    yield TestClient(app)
+    app.dependency_overrides.clear()
+
+
+@pytest.mark.parametrize("command", ["add_user", "remove_user"])
+def test_missing_user_uuid_returns_400(client, command):
+    response = client.post("/commands", json={"command": command})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "user_uuid is required for this command"}
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        {"command": "regenerate_user", "user_uuid": VALID_UUID},
+        {"command": "regenerate_user", "old_user_uuid": VALID_UUID},
+        {"command": "regenerate_user", "old_user_uuid": "not-a-uuid"},
+    ],
+)
+def test_regenerate_missing_uuid_returns_400(client, body):
+    response = client.post("/commands", json=body)
+    assert response.status_code == 400
+    assert response.json() == {
+        "detail": "Both old_user_uuid and user_uuid are required for regenerate_user command"
+    }
+
+
+def test_invalid_uuid_returns_400(client):
+    response = client.post("/commands", json={"command": "add_user", "user_uuid": "not-a-uuid"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Invalid UUID format"}
+
+
+def test_unknown_command_returns_400(client):
+    response = client.post("/commands", json={"command": "reboot"})
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown command: reboot"}
+
+
+def test_other_validation_errors_keep_422(client):
+    response = client.post("/commands", json={"command": "add_user", "user_uuid": VALID_UUID, "email": 1})
+    assert response.status_code == 422